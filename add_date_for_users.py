@@ -1,38 +1,92 @@
+"""
+add_date_for_users.py — Date every user by the first daily snapshot it appears in.
+
+`extract_users.sh` exports the users collection once per day to
+`{users_csv_dir}/users_YYYY_MM_DD.csv`. Each snapshot newer than the last
+date in `{dumped_file_dir}/users_with_date.csv` is anti-joined against the
+uuids already dated there, and only the users seen for the first time are
+appended, with the snapshot's date. Users missing from a later snapshot keep
+their first date. The work per snapshot is proportional to its size, so a
+backfill over years of snapshots grows linearly.
+"""
+
 import pandas as pd
+import numpy as np
 import glob
+import os
 import re
 import configparser
 
 
-configParser = configparser.ConfigParser()
-configParser.read('config')
-users_csv_dir = configParser.get('PATH', 'users_csv_dir')
-dumped_file_dir = configParser.get('PATH', 'dumped_file_dir')
+def snapshot_date(path):
+    return re.search(r"\d{4}_\d{2}_\d{2}", path).group().replace('_', '-')
+
+
+def list_snapshots(users_csv_dir):
+    """Daily snapshots in date order; a Parquet one from mongo_archive.py wins over a CSV of the same day."""
+    snapshots = {}
+    for path in sorted(glob.glob(f'{users_csv_dir}/users_*.csv')) + sorted(glob.glob(f'{users_csv_dir}/users_*.parquet')):
+        snapshots[snapshot_date(path)] = path
+    return [snapshots[date] for date in sorted(snapshots)]
+
+
+def read_snapshot(path):
+    if path.endswith('.parquet'):
+        return pd.read_parquet(path)
+    return pd.read_csv(path)
+
+
+def uuid_hashes(uuids):
+    """64-bit hashes of a uuid column, the keys of the first-seen index."""
+    return pd.util.hash_array(uuids.astype(str).to_numpy(dtype=object), categorize=False)
+
+
+def load_users_with_date(users_with_date_path, first_snapshot):
+    """Read the dated users, or date every user of *first_snapshot* if there are none yet.
+
+    Returns the table and the last snapshot date it covers.
+    """
+    if os.path.exists(users_with_date_path):
+        users_with_date = pd.read_csv(users_with_date_path)
+    else:
+        users_with_date = read_snapshot(first_snapshot).drop_duplicates(subset=['uuid'])
+        users_with_date['date'] = snapshot_date(first_snapshot)
+    return users_with_date, users_with_date.date.iloc[-1].replace(" 00:00:00", "")
+
 
-users_csv_files = glob.glob(f'{users_csv_dir}/*.csv')
-users_csv_files.sort()
+def add_first_seen(users_with_date, snapshot_files, last_date):
+    """Append the users of each snapshot dated after *last_date* that are not yet known."""
+    known = uuid_hashes(users_with_date['uuid'])
+    new_users = []
+    for file in snapshot_files:
+        date = snapshot_date(file)
+        if date <= last_date:
+            continue
 
-users_with_date_file = glob.glob(f'{dumped_file_dir}/users_with_date.csv')
+        df = read_snapshot(file)
+        hashes = uuid_hashes(df['uuid'])
+        is_new = ~pd.Series(hashes).isin(known).to_numpy()
+        if not is_new.any():
+            continue
 
-st_file_ind = 1
-if len(users_with_date_file) == 0:
-    date = re.search(r"\d{4}_\d{2}_\d{2}", users_csv_files[0]).group().replace('_', '-')
-    df = pd.read_csv(users_csv_files[0])
-    df['date'] = date
-    df.to_csv(f'{dumped_file_dir}/users_with_date.csv', index=False)
-    st_file_ind = 0
+        # a uuid listed twice in one snapshot is dated once
+        df = df[is_new].drop_duplicates(subset=['uuid'])
+        df['date'] = date
+        new_users.append(df)
+        known = np.concatenate([known, uuid_hashes(df['uuid'])])
 
+    return pd.concat([users_with_date, *new_users], ignore_index=True)
 
-users_with_date = pd.read_csv(f'{dumped_file_dir}/users_with_date.csv')
-the_last_date = users_with_date.date.iloc[-1].replace(" 00:00:00", "")
 
-for file in users_csv_files[st_file_ind:]:
-    date = re.search(r"\d{4}_\d{2}_\d{2}", file).group().replace('_', '-')
+if __name__ == '__main__':
+    configParser = configparser.ConfigParser()
+    configParser.read('config')
+    users_csv_dir = configParser.get('PATH', 'users_csv_dir')
+    dumped_file_dir = configParser.get('PATH', 'dumped_file_dir')
 
-    if date > the_last_date:
-        df = pd.read_csv(file)
-        new_records = pd.concat([users_with_date,df]).drop_duplicates(keep=False, subset=['uuid'])
-        new_records['date'] = date
-        users_with_date = pd.concat([users_with_date,new_records])
+    users_csv_files = list_snapshots(users_csv_dir)
+    users_with_date_path = f'{dumped_file_dir}/users_with_date.csv'
 
-users_with_date.to_csv(f'{dumped_file_dir}/users_with_date.csv', index=False)
\ No newline at end of file
+    users_with_date, last_date = load_users_with_date(users_with_date_path, users_csv_files[0])
+    users_with_date = add_first_seen(users_with_date, users_csv_files, last_date)
+    users_with_date.to_csv(users_with_date_path, index=False)
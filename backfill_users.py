@@ -0,0 +1,122 @@
+"""
+backfill_users.py — Rebuild the daily users snapshots from the Mongo backups in parallel.
+
+`extract_users.sh` restores one `mongo_backup_YYYY_MM_DD.tar.gz` after the
+other into the shared `carta-telemetry` database. This tool restores many
+archives at once instead: each worker of a process pool restores only the
+users collection of its archive into a database of its own
+(`mongorestore --nsFrom/--nsTo`), exports it to
+`{users_csv_dir}/users_YYYY_MM_DD.csv` like `extract_users.sh`, and drops
+the database again. The snapshots are then dated with the first-seen index
+of `add_date_for_users.py`.
+
+    python backfill_users.py [--workers N] [--rebuild]
+
+Archives that already have a snapshot, CSV or the Parquet one written by
+`mongo_archive.py`, are skipped. `--rebuild` re-exports every archive and
+re-dates all users from scratch, e.g. after a schema change; otherwise only
+the new snapshots are dated. A new snapshot dated on or before the last
+dated one (an older archive restored late) can move users' first-seen date
+back, so all users are then re-dated from scratch as well. Needs
+`mongorestore`, `mongoexport` and `mongosh` on the PATH and a local mongod.
+"""
+
+import argparse
+import configparser
+import glob
+import os
+import re
+import subprocess
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+from add_date_for_users import add_first_seen, list_snapshots, load_users_with_date, snapshot_date
+
+SOURCE_NAMESPACE = "carta-telemetry.users"
+USER_FIELDS = "_id,uuid,countryCode,optOut,regionCode"
+MONGO_ARGS = ["--host=localhost", "--port=27017"]
+
+
+def backup_date(path: str) -> str:
+    return re.search(r"\d{4}_\d{2}_\d{2}", os.path.basename(path)).group()
+
+
+def export_users_snapshot(archive: str, users_csv_dir: str) -> str:
+    """Restore the users of one backup archive into a scratch database and export them."""
+    date = backup_date(archive)
+    database = f"carta-telemetry-backfill-{date}"
+    output = f"{users_csv_dir}/users_{date}.csv"
+    try:
+        subprocess.run(
+            ["mongorestore", *MONGO_ARGS, "--gzip", "--drop", "--quiet", f"--archive={archive}",
+             f"--nsInclude={SOURCE_NAMESPACE}", f"--nsFrom={SOURCE_NAMESPACE}",
+             f"--nsTo={database}.users"],
+            check=True,
+        )
+        # write next to the target and rename, so an interrupted export is redone
+        subprocess.run(
+            ["mongoexport", *MONGO_ARGS, f"--db={database}", "--collection=users", "--type=csv",
+             f"--fields={USER_FIELDS}", "--quiet", f"--out={output}.tmp"],
+            check=True,
+        )
+        os.replace(f"{output}.tmp", output)
+    finally:
+        subprocess.run(
+            ["mongosh", "--quiet", *MONGO_ARGS, database, "--eval", "db.dropDatabase()"],
+            check=False,
+            stdout=subprocess.DEVNULL,
+        )
+    return output
+
+
+def backfill(workers: int, rebuild: bool = False) -> None:
+    configParser = configparser.ConfigParser()
+    configParser.read("config")
+    mongo_backup_dir = configParser.get("PATH", "mongo_backup_dir")
+    users_csv_dir = configParser.get("PATH", "users_csv_dir")
+    dumped_file_dir = configParser.get("PATH", "dumped_file_dir")
+    os.makedirs(users_csv_dir, exist_ok=True)
+
+    archives = sorted(glob.glob(f"{mongo_backup_dir}/mongo_backup_*.tar.gz"))
+    if not rebuild:
+        exported = {snapshot_date(path) for path in list_snapshots(users_csv_dir)}
+        archives = [a for a in archives if snapshot_date(backup_date(a)) not in exported]
+
+    start = time.time()
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        futures = {pool.submit(export_users_snapshot, a, users_csv_dir): a for a in archives}
+        for done, future in enumerate(as_completed(futures), 1):
+            future.result()
+            print(f"[{done}/{len(archives)}] {os.path.basename(futures[future])}")
+    print(f"exported {len(archives)} snapshots with {workers} workers in {time.time() - start:.1f}s")
+
+    # date the users by the first snapshot they appear in
+    start = time.time()
+    users_csv_files = list_snapshots(users_csv_dir)
+    if not users_csv_files:
+        sys.exit(f"no users snapshots in {users_csv_dir}: nothing to date")
+    users_with_date_path = f"{dumped_file_dir}/users_with_date.csv"
+    if rebuild and os.path.exists(users_with_date_path):
+        os.remove(users_with_date_path)
+    dated_before = os.path.exists(users_with_date_path)
+    users_with_date, last_date = load_users_with_date(users_with_date_path, users_csv_files[0])
+    late = sorted(d for d in (snapshot_date(backup_date(a)) for a in archives) if d <= last_date)
+    if dated_before and late:
+        print(f"{len(late)} new snapshot(s) dated on or before {last_date} ({late[0]}..{late[-1]}): "
+              "re-dating all users")
+        os.remove(users_with_date_path)
+        users_with_date, last_date = load_users_with_date(users_with_date_path, users_csv_files[0])
+    users_with_date = add_first_seen(users_with_date, users_csv_files, last_date)
+    users_with_date.to_csv(users_with_date_path, index=False)
+    print(f"dated {len(users_with_date)} users in {time.time() - start:.1f}s")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--workers", type=int, default=os.cpu_count(),
+                        help="archives restored at the same time (default: one per core)")
+    parser.add_argument("--rebuild", action="store_true",
+                        help="re-export every archive and re-date all users")
+    args = parser.parse_args()
+    backfill(args.workers, args.rebuild)
@@ -0,0 +1,170 @@
+"""
+cache.py — Memoized figure callbacks for the CARTA telemetry dashboard.
+
+`render_content` recreates the graphs on every tab switch, so all figure
+callbacks refire with the same inputs over and over, from every browser.
+`cached_figure` keys each figure on the callback name, its normalized inputs,
+the version stamp of the processed data and a hash of the dashboard code,
+and keeps it in two bounded LRU stores:
+
+- a small in-process one, and
+- a directory of pickled figures (`figure_cache_dir` in the [SERVER] section
+  of `config`) shared by every gunicorn worker; least recently used files
+  are deleted beyond `figure_cache_size` entries.
+
+`memoized` keeps an intermediate result that several figure callbacks of
+the same request build on, with the same normalized-input and data-version
+key, in a small in-process LRU store.
+
+When `preprocess_df.py` rewrites the processed data, or a deploy changes a
+module of the dashboard, the key changes, so figures of the old data or
+built by the old code are never served again and age out.
+"""
+
+import functools
+import glob
+import hashlib
+import os
+import pickle
+from collections import OrderedDict
+from datetime import datetime
+
+from data import DATA_VERSION, FIGURE_CACHE_DIR, FIGURE_CACHE_SIZE
+
+MEMORY_CACHE_SIZE = 64  # figures kept per worker
+
+_MISSING = object()
+_memory = OrderedDict()
+
+
+def code_version() -> str:
+    """Short hash of the dashboard's Python modules, which build the figures."""
+    digest = hashlib.sha1()
+    for path in sorted(glob.glob(f"{os.path.dirname(os.path.abspath(__file__))}/*.py")):
+        with open(path, "rb") as f:
+            digest.update(f.read())
+    return digest.hexdigest()[:16]
+
+
+CODE_VERSION = code_version()
+
+
+def _normalize(value):
+    """Drop the midnight suffix the date picker sometimes adds to its dates.
+
+    Timestamps and datetimes become the same ISO strings.
+    """
+    if isinstance(value, datetime):
+        value = value.isoformat()
+    if isinstance(value, str) and value.endswith("T00:00:00"):
+        return value[: -len("T00:00:00")]
+    return value
+
+
+def _cache_key(name: str, args: tuple) -> str:
+    return hashlib.sha1(repr((DATA_VERSION, CODE_VERSION, name, args)).encode()).hexdigest()
+
+
+# ---------------------------------------------------------------------------
+# Shared on-disk store
+# ---------------------------------------------------------------------------
+
+
+def _disk_get(key: str):
+    path = f"{FIGURE_CACHE_DIR}/{key}.pkl"
+    try:
+        with open(path, "rb") as f:
+            value = pickle.load(f)
+        os.utime(path)  # mtime doubles as the last-use time for eviction
+    except (OSError, EOFError, pickle.UnpicklingError):
+        return _MISSING
+    return value
+
+
+def _disk_put(key: str, value) -> None:
+    path = f"{FIGURE_CACHE_DIR}/{key}.pkl"
+    staging = f"{path}.{os.getpid()}.tmp"
+    try:
+        os.makedirs(FIGURE_CACHE_DIR, exist_ok=True)
+        with open(staging, "wb") as f:
+            pickle.dump(value, f, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(staging, path)  # readers never see a partial file
+        _evict()
+    except OSError:
+        pass  # the cache is an optimization; a full or read-only disk is not an error
+
+
+def _evict() -> None:
+    """Delete the least recently used files beyond FIGURE_CACHE_SIZE."""
+    entries = [e for e in os.scandir(FIGURE_CACHE_DIR) if e.name.endswith(".pkl")]
+    if len(entries) <= FIGURE_CACHE_SIZE:
+        return
+    entries.sort(key=lambda e: e.stat().st_mtime)
+    for entry in entries[: len(entries) - FIGURE_CACHE_SIZE]:
+        try:
+            os.remove(entry.path)
+        except FileNotFoundError:
+            pass  # evicted by another worker
+
+
+# ---------------------------------------------------------------------------
+# Decorator
+# ---------------------------------------------------------------------------
+
+
+def cached_figure(func):
+    """Memoize a figure callback on its inputs and the data and code versions.
+
+    Apply below `@app.callback(...)`. Figures are computed from the
+    normalized inputs, so equivalent inputs also give identical figures.
+    """
+
+    @functools.wraps(func)
+    def wrapper(*args):
+        args = tuple(_normalize(a) for a in args)
+        key = _cache_key(func.__name__, args)
+        if key in _memory:
+            _memory.move_to_end(key)
+            return _memory[key]
+
+        value = _MISSING
+        if FIGURE_CACHE_DIR:
+            value = _disk_get(key)
+        if value is _MISSING:
+            value = func(*args)
+            if FIGURE_CACHE_DIR:
+                _disk_put(key, value)
+
+        _memory[key] = value
+        if len(_memory) > MEMORY_CACHE_SIZE:
+            _memory.popitem(last=False)
+        return value
+
+    return wrapper
+
+
+def memoized(maxsize: int = 32):
+    """Memoize a helper shared by several figure callbacks, in this process only.
+
+    Keyed like cached_figure() on the normalized inputs and the data
+    version. Callers share the returned object and must not modify it.
+    """
+
+    def decorator(func):
+        results = OrderedDict()
+
+        @functools.wraps(func)
+        def wrapper(*args):
+            args = tuple(_normalize(a) for a in args)
+            key = (DATA_VERSION, args)
+            if key in results:
+                results.move_to_end(key)
+                return results[key]
+            value = results[key] = func(*args)
+            if len(results) > maxsize:
+                results.popitem(last=False)
+            return value
+
+        return wrapper
+
+    return decorator
@@ -14,37 +14,59 @@ import plotly.graph_objects as go
 from dash import Input, Output, ctx, dcc
 from dash_bootstrap_templates import ThemeSwitchAIO
 from plotly.subplots import make_subplots
-from pycountry_convert import country_name_to_country_alpha3
 
 from data import (
     SHOWED_COUNTRY_NUM,
     SIZE_LABELS,
     SIZE_LABEL_INDEX,
-    entries_df,
-    files_df,
+    country_alpha3,
+    daily_cube,
+    daily_cube_country_index,
+    daily_file_shapes,
+    daily_file_shapes_country_index,
+    daily_file_sizes,
+    daily_file_sizes_country_index,
+    daily_os_versions,
+    daily_os_versions_country_index,
+    daily_first_seen,
+    ip_index,
+    ip_sketches,
     missing_data_dates,
-    sessions_df,
+    session_index,
+    session_sketches,
     users_df,
 )
+from cache import cached_figure, memoized
+from distinct import period_distinct_counts
 from helpers import (
     add_incomplete_data_annotations,
     apply_date_xaxis,
     apply_standard_legend,
+    clear_template_colors,
     compute_end_date,
-    filter_by_country,
     get_missing_data_annotations,
     get_period_params,
-    get_theme,
+    period_window,
 )
 from layout import (
     OPT_IN_DISCLAIMER,
     OPT_IN_PCT,
     country_tab,
+    figure_graph,
     file_tab,
     home_tab,
     users_tab,
     version_os_tab,
 )
+from rollup import (
+    SHAPE_BIN_SIZE,
+    SHAPE_BINS,
+    cube_counts,
+    file_shape_histograms,
+    file_size_crosstab,
+    first_seen_series,
+    os_version_counts,
+)
 
 # Import app last to avoid circular import
 from app import app
@@ -77,20 +99,28 @@ def render_content(tab):
 )
 def render_counts_content(tab):
     if tab == "unique-IP_tab":
-        return dcc.Graph(id="users-unique-IP"), dcc.Markdown(
-            "Every IP recorded only once since the telemetry started"
+        return (
+            *figure_graph("users-unique-IP"),
+            dcc.Markdown("Every IP recorded only once since the telemetry started"),
         )
     elif tab == "uuid_tab":
-        return dcc.Graph(id="users-uuid"), dcc.Markdown(
-            "Unique ID for each computer"
+        return (
+            *figure_graph("users-uuid"),
+            dcc.Markdown("Unique ID for each computer"),
         )
     elif tab == "active-IP_tab":
-        return dcc.Graph(id="users-active-IP"), dcc.Markdown(
-            "Unduplicated IPs recorded during the selected period (monthly, weekly, daily)"
+        return (
+            *figure_graph("users-active-IP"),
+            dcc.Markdown(
+                "Unduplicated IPs recorded during the selected period (monthly, weekly, daily)"
+            ),
         )
     else:  # session_tab
-        return dcc.Graph(id="users-session"), dcc.Markdown(
-            f"Session numbers are from {OPT_IN_PCT} users allowing to share the telemetry data"
+        return (
+            *figure_graph("users-session"),
+            dcc.Markdown(
+                f"Session numbers are from {OPT_IN_PCT} users allowing to share the telemetry data"
+            ),
         )
 
 
@@ -101,15 +131,16 @@ def render_counts_content(tab):
 def render_versions(tab):
     if tab == "version_basic_tab":
         return (
-            dcc.Graph(id="version-pie"),
-            dcc.Graph(id="os-pie"),
+            *figure_graph("version-pie"),
+            *figure_graph("os-pie"),
             dcc.Markdown(
                 f"Platform distribution is based on data from {OPT_IN_DISCLAIMER}"
             ),
         )
     else:  # version_detail_tab
-        return dcc.Graph(id="os_detail-pie"), dcc.Markdown(
-            f"Data from {OPT_IN_DISCLAIMER}"
+        return (
+            *figure_graph("os_detail-pie"),
+            dcc.Markdown(f"Data from {OPT_IN_DISCLAIMER}"),
         )
 
 
@@ -120,20 +151,22 @@ def render_versions(tab):
 def render_files(tab):
     if tab == "file_size_tab":
         return (
-            dcc.Graph(id="file-type-pie"),
-            dcc.Graph(id="file-size-pie"),
-            dcc.Graph(id="file-size-bar"),
+            *figure_graph("file-type-pie"),
+            *figure_graph("file-size-pie"),
+            *figure_graph("file-size-bar"),
             dcc.Markdown(
                 f"All figures on this tab are based on data from {OPT_IN_DISCLAIMER}"
             ),
         )
     elif tab == "file_shape_tab":
-        return dcc.Graph(id="file-shape"), dcc.Markdown(
-            f"All figures on this tab are based on data from {OPT_IN_DISCLAIMER}"
+        return (
+            *figure_graph("file-shape"),
+            dcc.Markdown(f"All figures on this tab are based on data from {OPT_IN_DISCLAIMER}"),
         )
     else:  # action_tab
-        return dcc.Graph(id="action-bar"), dcc.Markdown(
-            f"Data from {OPT_IN_DISCLAIMER}"
+        return (
+            *figure_graph("action-bar"),
+            dcc.Markdown(f"Data from {OPT_IN_DISCLAIMER}"),
         )
 
 
@@ -194,27 +227,20 @@ def toggle_theme_class(toggle):
 
 
 @app.callback(
-    Output("country-map", "figure"),
+    Output("country-map-data", "data"),
     [
         Input("date-picker", "start_date"),
         Input("date-picker", "end_date"),
-        Input(ThemeSwitchAIO.ids.switch("theme"), "value"),
     ],
 )
-def update_country_map_chart(start_date, end_date, toggle):
-    theme = get_theme(toggle)
-    countries = users_df[
-        (users_df["datetime"] >= start_date) & (users_df["datetime"] <= end_date)
-    ]
+@cached_figure
+def update_country_map_chart(start_date, end_date):
     countries = (
-        countries.country.value_counts()
-        .to_frame()
+        cube_counts(daily_cube, daily_cube_country_index, "country", start_date, end_date)
+        .rename_axis("country")
         .reset_index()
-        .rename(columns={"index": "Value", "A": "Count"})
-    )
-    countries["iso_alpha"] = countries.country.apply(
-        lambda x: country_name_to_country_alpha3(x)
     )
+    countries["iso_alpha"] = countries.country.map(country_alpha3)
     fig = px.scatter_geo(
         countries,
         locations="iso_alpha",
@@ -222,31 +248,31 @@ def update_country_map_chart(start_date, end_date, toggle):
         size="count",
         projection="natural earth",
         size_max=20,
-        template=theme,
+        template="none",
     )
     fig.update_geos(showcountries=True)
     fig.update_layout(transition_duration=500, margin={"r": 0, "t": 50, "l": 0, "b": 0})
+    clear_template_colors(fig)
     return fig
 
 
 @app.callback(
-    Output("country-pie", "figure"),
+    Output("country-pie-data", "data"),
     [
         Input("date-picker", "start_date"),
         Input("date-picker", "end_date"),
-        Input(ThemeSwitchAIO.ids.switch("theme"), "value"),
     ],
 )
-def update_country_pie_chart(start_date, end_date, toggle):
-    theme = get_theme(toggle)
-    countries = users_df[
-        (users_df["datetime"] >= start_date) & (users_df["datetime"] <= end_date)
-    ]
-    countries = countries.country.value_counts().reset_index().rename(
-        columns={"index": "Value", "A": "Count"}
+@cached_figure
+def update_country_pie_chart(start_date, end_date):
+    counts = cube_counts(daily_cube, daily_cube_country_index, "country", start_date, end_date)
+    countries = (
+        counts.iloc[:SHOWED_COUNTRY_NUM]
+        .rename_axis("country")
+        .reset_index()
     )
-    for other in countries.iloc[SHOWED_COUNTRY_NUM:].country:
-        countries.loc[countries.country == other, "country"] = "Others"
+    if len(counts) > SHOWED_COUNTRY_NUM:
+        countries.loc[len(countries)] = ["Others", counts.iloc[SHOWED_COUNTRY_NUM:].sum()]
 
     fig = px.pie(
         countries,
@@ -254,7 +280,7 @@ def update_country_pie_chart(start_date, end_date, toggle):
         names="country",
         hole=0.4,
         hover_data=["country"],
-        template=theme,
+        template="none",
     )
     fig.update_traces(textinfo="percent+value+label", insidetextorientation="horizontal")
     fig.update_layout(
@@ -267,20 +293,18 @@ def update_country_pie_chart(start_date, end_date, toggle):
 
 
 @app.callback(
-    Output("country-other", "figure"),
+    Output("country-other-data", "data"),
     [
         Input("date-picker", "start_date"),
         Input("date-picker", "end_date"),
-        Input(ThemeSwitchAIO.ids.switch("theme"), "value"),
     ],
 )
-def update_other_country_chart(start_date, end_date, toggle):
-    theme = get_theme(toggle)
-    countries = users_df[
-        (users_df["datetime"] >= start_date) & (users_df["datetime"] <= end_date)
-    ]
-    countries = countries.country.value_counts().reset_index().rename(
-        columns={"index": "Value", "A": "Count"}
+@cached_figure
+def update_other_country_chart(start_date, end_date):
+    countries = (
+        cube_counts(daily_cube, daily_cube_country_index, "country", start_date, end_date)
+        .rename_axis("country")
+        .reset_index()
     )
     other_countries = countries.iloc[SHOWED_COUNTRY_NUM:]
 
@@ -291,7 +315,7 @@ def update_other_country_chart(start_date, end_date, toggle):
         text=other_countries["count"],
         labels={"y": "%", "x": "Country", "text": "Count"},
         hover_data=["country"],
-        template=theme,
+        template="none",
     )
     fig.update_traces(textfont_size=12, textangle=0, textposition="outside", cliponaxis=False)
     fig.update_layout(
@@ -300,47 +324,37 @@ def update_other_country_chart(start_date, end_date, toggle):
         xaxis_tickangle=45,
         xaxis_title=None,
     )
+    clear_template_colors(fig)
     return fig
 
 
 # ---------------------------------------------------------------------------
 # Users tab figures
 # ---------------------------------------------------------------------------
-
+# Unless "Full history" is on, only the resample buckets overlapping the
+# picker range are aggregated (helpers.period_window), and the cumulative
+# lines start from the total before them.
 
 @app.callback(
-    Output("users-unique-IP", "figure"),
+    Output("users-unique-IP-data", "data"),
     [
         Input("date-picker", "start_date"),
         Input("date-picker", "end_date"),
         Input("period-radio-item", "value"),
         Input("country-item", "value"),
-        Input("label-fontsize", "value"),
-        Input("legend-fontsize", "value"),
-        Input("x-tick-fontsize", "value"),
-        Input("y-tick-fontsize", "value"),
-        Input(ThemeSwitchAIO.ids.switch("theme"), "value"),
+        Input("full-history-switch", "value"),
     ],
 )
-def update_users_unique_IP_chart(
-    start_date, end_date, period_value, country_value,
-    label_fontsize, legend_fontsize, x_tick_fontsize, y_tick_fontsize, toggle,
-):
-    theme = get_theme(toggle)
+@cached_figure
+def update_users_unique_IP_chart(start_date, end_date, period_value, country_value, full_history):
     period, fontsize, anno_y, day_shift = get_period_params(period_value)
-    anno_dates = get_missing_data_annotations(missing_data_dates, period)
     new_end_date = compute_end_date(end_date)
+    window = None if full_history else period_window(start_date, new_end_date, period)
+    anno_dates = get_missing_data_annotations(missing_data_dates, period, window)
 
-    mask = filter_by_country(entries_df, country_value)
-    entries_selected = entries_df[mask]
-    unique_select = (
-        entries_selected.reset_index()
-        .groupby(["ipHash"])["index"]
-        .min()
-        .to_list()
+    monthly_unique_ip, cum_unique_ip = first_seen_series(
+        daily_first_seen, "ipHash", period, country_value, window
     )
-    monthly_unique_ip = entries_selected.loc[unique_select].resample(period, on="datetime").size()
-    cum_unique_ip = np.cumsum(monthly_unique_ip)
 
     fig = make_subplots(specs=[[{"secondary_y": True}]])
     fig.add_trace(
@@ -357,61 +371,43 @@ def update_users_unique_IP_chart(
         secondary_y=True,
     )
 
-    fig.update_layout(title_text="Unique IP counts", template=theme)
+    fig.update_layout(title_text="Unique IP counts", template="none")
     apply_date_xaxis(fig, start_date, new_end_date)
     fig.update_yaxes(
         title_text="# Unique IP",
         secondary_y=False,
         gridcolor="lightblue",
-        title_font=dict(size=label_fontsize),
-        tickfont=dict(size=y_tick_fontsize),
     )
     fig.update_yaxes(
         title_text="# Cumulative Unique IP",
         color="red",
         secondary_y=True,
         gridcolor="#fccfd2",
-        title_font=dict(size=label_fontsize),
-        tickfont=dict(size=y_tick_fontsize),
     )
-    fig.update_xaxes(
-        rangeselector_y=1.0,
-        rangeselector_x=0.5,
-        title_font=dict(size=label_fontsize),
-        tickfont=dict(size=x_tick_fontsize),
-    )
-    apply_standard_legend(fig, legend_fontsize)
+    fig.update_xaxes(rangeselector_y=1.0, rangeselector_x=0.5)
+    apply_standard_legend(fig)
     add_incomplete_data_annotations(fig, anno_dates, day_shift, anno_y, fontsize)
     return fig
 
 
 @app.callback(
-    Output("users-uuid", "figure"),
+    Output("users-uuid-data", "data"),
     [
         Input("date-picker", "start_date"),
         Input("date-picker", "end_date"),
         Input("period-radio-item", "value"),
         Input("country-item", "value"),
-        Input("label-fontsize", "value"),
-        Input("legend-fontsize", "value"),
-        Input("x-tick-fontsize", "value"),
-        Input("y-tick-fontsize", "value"),
-        Input(ThemeSwitchAIO.ids.switch("theme"), "value"),
+        Input("full-history-switch", "value"),
     ],
 )
-def update_users_uuid_chart(
-    start_date, end_date, period_value, country_value,
-    label_fontsize, legend_fontsize, x_tick_fontsize, y_tick_fontsize, toggle,
-):
-    theme = get_theme(toggle)
+@cached_figure
+def update_users_uuid_chart(start_date, end_date, period_value, country_value, full_history):
     period, fontsize, anno_y, day_shift = get_period_params(period_value)
-    anno_dates = get_missing_data_annotations(missing_data_dates, period)
     new_end_date = compute_end_date(end_date)
+    window = None if full_history else period_window(start_date, new_end_date, period)
+    anno_dates = get_missing_data_annotations(missing_data_dates, period, window)
 
-    mask = filter_by_country(users_df, country_value)
-    users_selected = users_df[mask]
-    monthly_uuid = users_selected.resample(period, on="datetime").size()
-    cum_uuid = np.cumsum(monthly_uuid)
+    monthly_uuid, cum_uuid = first_seen_series(daily_first_seen, "uuid", period, country_value, window)
 
     fig = make_subplots(specs=[[{"secondary_y": True}]])
     fig.add_trace(
@@ -428,132 +424,99 @@ def update_users_uuid_chart(
         secondary_y=True,
     )
 
-    fig.update_layout(title_text="UUID counts", template=theme)
+    fig.update_layout(title_text="UUID counts", template="none")
     apply_date_xaxis(fig, start_date, new_end_date)
     fig.update_yaxes(
         title_text="# UUID",
         secondary_y=False,
         gridcolor="lightblue",
-        title_font=dict(size=label_fontsize),
-        tickfont=dict(size=y_tick_fontsize),
     )
     fig.update_yaxes(
         title_text="# Cumulative UUID",
         color="red",
         secondary_y=True,
         gridcolor="#fccfd2",
-        title_font=dict(size=label_fontsize),
-        tickfont=dict(size=y_tick_fontsize),
-    )
-    fig.update_xaxes(
-        rangeselector_y=1.0,
-        rangeselector_x=0.5,
-        title_font=dict(size=label_fontsize),
-        tickfont=dict(size=x_tick_fontsize),
     )
-    apply_standard_legend(fig, legend_fontsize)
+    fig.update_xaxes(rangeselector_y=1.0, rangeselector_x=0.5)
+    apply_standard_legend(fig)
     add_incomplete_data_annotations(fig, anno_dates, day_shift, anno_y, fontsize)
     return fig
 
 
 @app.callback(
-    Output("users-active-IP", "figure"),
+    Output("users-active-IP-data", "data"),
     [
         Input("date-picker", "start_date"),
         Input("date-picker", "end_date"),
         Input("period-radio-item", "value"),
         Input("country-item", "value"),
-        Input("label-fontsize", "value"),
-        Input("legend-fontsize", "value"),
-        Input("x-tick-fontsize", "value"),
-        Input("y-tick-fontsize", "value"),
-        Input(ThemeSwitchAIO.ids.switch("theme"), "value"),
+        Input("full-history-switch", "value"),
     ],
 )
-def update_users_active_IP_chart(
-    start_date, end_date, period_value, country_value,
-    label_fontsize, legend_fontsize, x_tick_fontsize, y_tick_fontsize, toggle,
-):
-    theme = get_theme(toggle)
+@cached_figure
+def update_users_active_IP_chart(start_date, end_date, period_value, country_value, full_history):
     period, fontsize, anno_y, day_shift = get_period_params(period_value)
-    anno_dates = get_missing_data_annotations(missing_data_dates, period)
     new_end_date = compute_end_date(end_date)
+    window = None if full_history else period_window(start_date, new_end_date, period)
+    anno_dates = get_missing_data_annotations(missing_data_dates, period, window)
 
-    mask = filter_by_country(entries_df, country_value)
-    entries_selected = entries_df[mask]
-    monthly_ip = entries_selected.resample(period, on="datetime").apply(
-        lambda x: x.ipHash.unique().size
+    monthly_ip, approximate = period_distinct_counts(
+        ip_index, period, country_value, ip_sketches, window
     )
 
     fig = go.Figure()
     fig.add_trace(go.Bar(x=monthly_ip.keys() + day_shift, y=monthly_ip.values, name="Active IP"))
-    fig.update_layout(title_text="Active IP counts", template=theme)
-    apply_date_xaxis(fig, start_date, new_end_date)
-    fig.update_xaxes(
-        rangeselector_y=1.0,
-        rangeselector_x=0.5,
-        title_font=dict(size=label_fontsize),
-        tickfont=dict(size=x_tick_fontsize),
+    fig.update_layout(
+        title_text="≈ Active IP counts" if approximate else "Active IP counts",
+        template="none",
     )
+    apply_date_xaxis(fig, start_date, new_end_date)
+    fig.update_xaxes(rangeselector_y=1.0, rangeselector_x=0.5)
     fig.update_yaxes(
         title_text="# Active IP",
         gridcolor="lightblue",
-        title_font=dict(size=label_fontsize),
-        tickfont=dict(size=y_tick_fontsize),
     )
-    apply_standard_legend(fig, legend_fontsize)
+    apply_standard_legend(fig)
     add_incomplete_data_annotations(fig, anno_dates, day_shift, anno_y, fontsize)
     return fig
 
 
 @app.callback(
-    Output("users-session", "figure"),
+    Output("users-session-data", "data"),
     [
         Input("date-picker", "start_date"),
         Input("date-picker", "end_date"),
         Input("period-radio-item", "value"),
         Input("country-item", "value"),
-        Input("label-fontsize", "value"),
-        Input("legend-fontsize", "value"),
-        Input("x-tick-fontsize", "value"),
-        Input("y-tick-fontsize", "value"),
-        Input(ThemeSwitchAIO.ids.switch("theme"), "value"),
+        Input("full-history-switch", "value"),
     ],
 )
-def update_users_session_chart(
-    start_date, end_date, period_value, country_value,
-    label_fontsize, legend_fontsize, x_tick_fontsize, y_tick_fontsize, toggle,
-):
-    theme = get_theme(toggle)
+@cached_figure
+def update_users_session_chart(start_date, end_date, period_value, country_value, full_history):
     period, fontsize, anno_y, day_shift = get_period_params(period_value)
-    anno_dates = get_missing_data_annotations(missing_data_dates, period)
     new_end_date = compute_end_date(end_date)
+    window = None if full_history else period_window(start_date, new_end_date, period)
+    anno_dates = get_missing_data_annotations(missing_data_dates, period, window)
 
-    mask = filter_by_country(entries_df, country_value)
-    entries_selected = entries_df[mask]
-    monthly_session = entries_selected.resample(period, on="datetime").apply(
-        lambda x: x.sessionId.unique().size
+    monthly_session, approximate = period_distinct_counts(
+        session_index, period, country_value, session_sketches, window
     )
 
     fig = go.Figure()
     fig.add_trace(
         go.Bar(x=monthly_session.keys() + day_shift, y=monthly_session.values, name="session")
     )
-    fig.update_layout(title_text="Session counts", template=theme)
-    apply_date_xaxis(fig, start_date, new_end_date)
-    fig.update_xaxes(
-        rangeselector_y=1.0,
-        rangeselector_x=0.5,
-        title_font=dict(size=label_fontsize),
-        tickfont=dict(size=x_tick_fontsize),
+    fig.update_layout(
+        title_text="≈ Session counts" if approximate else "Session counts",
+        template="none",
     )
+    apply_date_xaxis(fig, start_date, new_end_date)
+    fig.update_xaxes(rangeselector_y=1.0, rangeselector_x=0.5)
     fig.update_yaxes(
         title_text="# Session",
         gridcolor="lightblue",
-        title_font=dict(size=label_fontsize),
-        tickfont=dict(size=y_tick_fontsize),
     )
-    apply_standard_legend(fig, legend_fontsize)
+    apply_standard_legend(fig)
     add_incomplete_data_annotations(fig, anno_dates, day_shift, anno_y, fontsize)
     return fig
 
@@ -564,26 +527,28 @@ def update_users_session_chart(
 
 
 @app.callback(
-    Output("version-pie", "figure"),
+    Output("version-pie-data", "data"),
     [
         Input("date-picker", "start_date"),
         Input("date-picker", "end_date"),
         Input("country-item", "value"),
-        Input(ThemeSwitchAIO.ids.switch("theme"), "value"),
     ],
 )
-def update_version_pie_chart(start_date, end_date, country_value, toggle):
-    theme = get_theme(toggle)
-    mask = filter_by_country(sessions_df, country_value)
-    versions = sessions_df[
-        (sessions_df["datetime"] >= start_date)
-        & (sessions_df["datetime"] <= end_date)
-        & mask
-    ]
-    for other in versions.version.value_counts().keys()[5:]:
-        versions.loc[versions.version == other, "version"] = "Others"
+@cached_figure
+def update_version_pie_chart(start_date, end_date, country_value):
+    counts = cube_counts(daily_cube, daily_cube_country_index, "version", start_date, end_date, country_value)
+    versions = counts.iloc[:5].rename_axis("version").reset_index()
+    if len(counts) > 5:
+        versions.loc[len(versions)] = ["Others", counts.iloc[5:].sum()]
 
-    fig = px.pie(versions, names="version", title="Version distribution", hole=0.4, template=theme)
+    fig = px.pie(
+        versions,
+        values="count",
+        names="version",
+        title="Version distribution",
+        hole=0.4,
+        template="none",
+    )
     fig.update_traces(textinfo="value+percent+label", insidetextorientation="horizontal")
     fig.update_layout(
         transition_duration=500,
@@ -594,28 +559,29 @@ def update_version_pie_chart(start_date, end_date, country_value, toggle):
 
 
 @app.callback(
-    Output("os-pie", "figure"),
+    Output("os-pie-data", "data"),
     [
         Input("date-picker", "start_date"),
         Input("date-picker", "end_date"),
         Input("country-item", "value"),
-        Input(ThemeSwitchAIO.ids.switch("theme"), "value"),
     ],
 )
-def update_os_pie_chart(start_date, end_date, country_value, toggle):
-    theme = get_theme(toggle)
-    mask = filter_by_country(sessions_df, country_value)
-    platform = sessions_df[
-        (sessions_df["datetime"] >= start_date)
-        & (sessions_df["datetime"] <= end_date)
-        & mask
-    ]
+@cached_figure
+def update_os_pie_chart(start_date, end_date, country_value):
+    platform = (
+        cube_counts(
+            daily_cube, daily_cube_country_index, "backendPlatform", start_date, end_date, country_value
+        )
+        .rename_axis("backendPlatform")
+        .reset_index()
+    )
     fig = px.pie(
         platform,
+        values="count",
         names="backendPlatform",
         title="Platform distribution",
         hole=0.4,
-        template=theme,
+        template="none",
     )
     fig.update_traces(textinfo="value+percent+label", insidetextorientation="horizontal")
     fig.update_layout(
@@ -626,88 +592,72 @@ def update_os_pie_chart(start_date, end_date, country_value, toggle):
     return fig
 
 
+def _top_versions(counts, os_names, n):
+    """Sunburst rows of the *n* largest OS versions of each of *os_names*, then its "others".
+
+    *counts* is indexed by (OS, OS_version). Rows come grouped by OS in the
+    order of *os_names*, largest version first.
+    """
+    versions = counts[
+        counts.index.get_level_values("OS").isin(os_names)
+        & counts.index.get_level_values("OS_version").notna()
+    ].sort_values(ascending=False, kind="stable")
+    rank = versions.groupby(level="OS", observed=True).cumcount().to_numpy()
+    shown = versions[rank < n]
+    others = versions[rank >= n].groupby(level="OS", observed=True).sum()
+    rows = pd.concat(
+        [
+            pd.DataFrame({
+                "os": shown.index.get_level_values("OS").astype(object),
+                "version": shown.index.get_level_values("OS_version").astype(object),
+                "count": shown.to_numpy(),
+            }),
+            pd.DataFrame({
+                "os": os_names,
+                "version": "others",
+                "count": [others.get(name, 0) for name in os_names],
+            }),
+        ],
+        ignore_index=True,
+    )
+    position = rows["os"].map({name: i for i, name in enumerate(os_names)}).to_numpy()
+    return rows.iloc[np.argsort(position, kind="stable")]
+
+
 @app.callback(
-    Output("os_detail-pie", "figure"),
+    Output("os_detail-pie-data", "data"),
     [
         Input("date-picker", "start_date"),
         Input("date-picker", "end_date"),
         Input("country-item", "value"),
-        Input(ThemeSwitchAIO.ids.switch("theme"), "value"),
     ],
 )
-def update_os_detail_pie_chart(start_date, end_date, country_value, toggle):
-    theme = get_theme(toggle)
-    mask = filter_by_country(sessions_df, country_value)
-
-    linux = sessions_df[
-        (sessions_df["datetime"] >= start_date)
-        & (sessions_df["datetime"] <= end_date)
-        & (sessions_df["backendPlatform"] == "Linux")
-        & sessions_df["version"].notna()
-        & mask
-    ]
-    linux_OS = linux["OS"].value_counts().reset_index().rename(
-        columns={"index": "Value", "A": "Count"}
-    )
-    linux_sub = {}
-    for selected_OS in linux_OS["OS"]:
-        linux_selected = linux[linux["OS"] == selected_OS]
-        linux_sub[selected_OS] = linux_selected["OS_version"].value_counts().reset_index().rename(
-            columns={"index": "Value", "A": "Count"}
-        )
-
-    mac = sessions_df[
-        (sessions_df["datetime"] >= start_date)
-        & (sessions_df["datetime"] <= end_date)
-        & (sessions_df["backendPlatform"] == "macOS")
-        & sessions_df["version"].notna()
-        & mask
-    ]
-    mac_sub = {}
-    for selected_OS in mac["OS"].value_counts().reset_index()["OS"]:
-        mac_selected = mac[mac["OS"] == selected_OS]
-        mac_sub[selected_OS] = mac_selected["OS_version"].value_counts().reset_index().rename(
-            columns={"index": "Value", "A": "Count"}
-        )
-
-    # Fix: always assign showed_linux_num (was a NameError bug when len < 3)
-    showed_linux_num = min(len(linux_sub), 3)
-
-    version_labels, version_values, os_array, platform_array = [], [], [], []
-
-    for i in range(showed_linux_num):
-        the_linux = linux_sub[list(linux_sub.keys())[i]]
-        showed_num = min(len(the_linux["OS_version"]), 3)
-
-        version_labels += the_linux["OS_version"][:showed_num].to_list()
-        version_values += the_linux["count"][:showed_num].to_list()
-        version_labels += ["others"]
-        version_values += [the_linux["count"][showed_num:].sum()]
-
-        os_key = list(linux_sub.keys())[i]
-        os_array += [os_key] * (showed_num + 1)
-        platform_array += ["Linux"] * (showed_num + 1)
-
-    version_labels += [None]
-    os_array += ["others"]
-    version_values += [linux_OS["count"][showed_linux_num:].sum()]
-    platform_array += ["Linux"]
-
-    if "macOS" in mac_sub and not mac_sub["macOS"].empty:
-        the_mac = mac_sub["macOS"]
-        showed_num = min(len(the_mac["OS_version"]), 3)
-
-        version_labels += the_mac["OS_version"][:showed_num].to_list()
-        version_values += the_mac["count"][:showed_num].to_list()
-        version_labels += ["others"]
-        version_values += [the_mac["count"][showed_num:].sum()]
-        os_array += [list(mac_sub.keys())[0]] * (showed_num + 1)
-        platform_array += ["macOS"] * (showed_num + 1)
-
-    df = pd.DataFrame(
-        dict(os=os_array, version=version_labels, count=version_values, platform=platform_array)
+@cached_figure
+def update_os_detail_pie_chart(start_date, end_date, country_value):
+    counts = os_version_counts(
+        daily_os_versions, daily_os_versions_country_index, start_date, end_date, country_value
+    )
+    platform = counts.index.get_level_values("backendPlatform")
+
+    # the 3 most used Linux distros with their 3 most used versions, the rest as "others"
+    linux = counts[platform == "Linux"].droplevel("backendPlatform")
+    linux_OS = linux.groupby(level="OS", observed=True).sum().sort_values(ascending=False, kind="stable")
+    linux_rows = _top_versions(linux, list(linux_OS.index[:3].astype(object)), 3)
+    linux_rows = pd.concat(
+        [linux_rows, pd.DataFrame({"os": ["others"], "version": [None], "count": [linux_OS.iloc[3:].sum()]})],
+        ignore_index=True,
+    ).assign(platform="Linux")
+
+    mac = counts[platform == "macOS"].droplevel("backendPlatform")
+    has_mac_version = (
+        (mac.index.get_level_values("OS") == "macOS") & mac.index.get_level_values("OS_version").notna()
+    ).any()
+    mac_rows = _top_versions(mac, ["macOS"], 3).assign(platform="macOS") if has_mac_version else None
+
+    df = pd.concat([linux_rows, mac_rows], ignore_index=True)[["os", "version", "count", "platform"]]
+    fig = px.sunburst(
+        df, path=["platform", "os", "version"], values="count", template="none"
     )
-    fig = px.sunburst(df, path=["platform", "os", "version"], values="count", template=theme)
     fig.update_layout(
         transition_duration=1000,
         showlegend=False,
@@ -722,24 +672,32 @@ def update_os_detail_pie_chart(start_date, end_date, country_value, toggle):
 # ---------------------------------------------------------------------------
 
 
+@memoized(maxsize=32)
+def _file_size_crosstab(start_date, end_date, country_value):
+    """File type x size label counts, computed once for the three figures built from them."""
+    return file_size_crosstab(
+        daily_file_sizes, daily_file_sizes_country_index, start_date, end_date, country_value
+    )
+
+
+def _largest_first(counts):
+    """Non-zero counts of known labels, largest first."""
+    counts = counts[counts.index.notna() & (counts > 0)]
+    return counts.sort_values(ascending=False, kind="stable").rename("count")
+
+
 @app.callback(
-    Output("file-type-pie", "figure"),
+    Output("file-type-pie-data", "data"),
     [
         Input("date-picker", "start_date"),
         Input("date-picker", "end_date"),
         Input("country-item", "value"),
-        Input(ThemeSwitchAIO.ids.switch("theme"), "value"),
     ],
 )
-def update_file_pie_chart(start_date, end_date, country_value, toggle):
-    theme = get_theme(toggle)
-    mask = filter_by_country(files_df, country_value)
-    select_files = files_df[
-        (files_df["datetime"] >= start_date) & (files_df["datetime"] <= end_date) & mask
-    ]
-    file_types = select_files.file_type.value_counts().reset_index().rename(
-        columns={"index": "Value", "A": "Count"}
-    )
+@cached_figure
+def update_file_pie_chart(start_date, end_date, country_value):
+    crosstab = _file_size_crosstab(start_date, end_date, country_value)
+    file_types = _largest_first(crosstab.sum(axis="columns")).reset_index()
     fig = go.Figure(
         go.Pie(
             name="",
@@ -753,7 +711,7 @@ def update_file_pie_chart(start_date, end_date, country_value, toggle):
     fig.update_layout(
         transition_duration=500,
         title_text="File types distribution",
-        template=theme,
+        template="none",
         margin={"r": 0, "t": 50, "l": 0, "b": 0},
         showlegend=False,
     )
@@ -761,25 +719,18 @@ def update_file_pie_chart(start_date, end_date, country_value, toggle):
 
 
 @app.callback(
-    Output("file-size-pie", "figure"),
+    Output("file-size-pie-data", "data"),
     [
         Input("date-picker", "start_date"),
         Input("date-picker", "end_date"),
         Input("country-item", "value"),
-        Input(ThemeSwitchAIO.ids.switch("theme"), "value"),
     ],
 )
-def update_file_size_pie_chart(start_date, end_date, country_value, toggle):
-    theme = get_theme(toggle)
-    mask = filter_by_country(files_df, country_value)
-    select_files = files_df[
-        (files_df["datetime"] >= start_date) & (files_df["datetime"] <= end_date) & mask
-    ]
-    file_size_df = select_files["size_label"].value_counts().reset_index().rename(
-        columns={"index": "size_label", "A": "Count"}
-    )
-    for label in SIZE_LABELS:
-        file_size_df.loc[file_size_df.size_label == label, "index"] = SIZE_LABEL_INDEX[label]
+@cached_figure
+def update_file_size_pie_chart(start_date, end_date, country_value):
+    crosstab = _file_size_crosstab(start_date, end_date, country_value)
+    file_size_df = _largest_first(crosstab.sum(axis="index")).reset_index()
+    file_size_df["index"] = file_size_df["size_label"].map(SIZE_LABEL_INDEX)
     file_size_df.sort_values(by="index", inplace=True)
 
     fig = go.Figure(
@@ -795,7 +746,7 @@ def update_file_size_pie_chart(start_date, end_date, country_value, toggle):
     fig.update_layout(
         title_text="File size distribution",
         transition_duration=500,
-        template=theme,
+        template="none",
         margin={"r": 0, "t": 50, "l": 0, "b": 0},
         showlegend=False,
     )
@@ -803,25 +754,18 @@ def update_file_size_pie_chart(start_date, end_date, country_value, toggle):
 
 
 @app.callback(
-    Output("file-size-bar", "figure"),
+    Output("file-size-bar-data", "data"),
     [
         Input("date-picker", "start_date"),
         Input("date-picker", "end_date"),
         Input("country-item", "value"),
-        Input(ThemeSwitchAIO.ids.switch("theme"), "value"),
     ],
 )
-def update_file_size_bar_chart(start_date, end_date, country_value, toggle):
-    theme = get_theme(toggle)
-    mask = filter_by_country(files_df, country_value)
-    select_files = files_df[
-        (files_df["datetime"] >= start_date) & (files_df["datetime"] <= end_date) & mask
-    ]
+@cached_figure
+def update_file_size_bar_chart(start_date, end_date, country_value):
+    crosstab = _file_size_crosstab(start_date, end_date, country_value)
     size_by_type = {
-        sl: select_files.loc[select_files.size_label == sl, "file_type"]
-            .value_counts()
-            .reset_index()
-            .rename(columns={"index": "Value", "A": "Count"})
+        sl: _largest_first(crosstab.get(sl, pd.Series(0, index=crosstab.index))).reset_index()
         for sl in SIZE_LABELS
     }
     fig = go.Figure()
@@ -838,7 +782,7 @@ def update_file_size_bar_chart(start_date, end_date, country_value, toggle):
     fig.update_layout(
         barmode="stack",
         barnorm="percent",
-        template=theme,
+        template="none",
         legend=dict(orientation="h", yanchor="bottom", y=1.02, xanchor="right", x=1),
     )
     fig.update_xaxes(title_text="%")
@@ -846,39 +790,28 @@ def update_file_size_bar_chart(start_date, end_date, country_value, toggle):
 
 
 @app.callback(
-    Output("file-shape", "figure"),
+    Output("file-shape-data", "data"),
     [
         Input("date-picker", "start_date"),
         Input("date-picker", "end_date"),
         Input("country-item", "value"),
-        Input(ThemeSwitchAIO.ids.switch("theme"), "value"),
     ],
 )
-def update_file_shape_chart(start_date, end_date, country_value, toggle):
-    theme = get_theme(toggle)
-    mask = filter_by_country(files_df, country_value)
-    select_files = files_df[
-        (files_df["datetime"] >= start_date) & (files_df["datetime"] <= end_date) & mask
-    ]
-    cube = select_files.loc[
-        (select_files.file_type == "3D") | (select_files.file_type == "3D+Stokes")
-    ]
-
-    hist_kwargs = dict(
-        colorscale="dense",
-        autobinx=False,
-        autobiny=False,
-        xbins=dict(start=0, end=5, size=0.2),
-        ybins=dict(start=0, end=5, size=0.2),
+@cached_figure
+def update_file_shape_chart(start_date, end_date, country_value):
+    # 25x25 log-pixel grids summed from the daily file shapes, not the raw files
+    histograms = file_shape_histograms(
+        daily_file_shapes, daily_file_shapes_country_index, start_date, end_date, country_value
     )
+    bin_centers = (np.arange(SHAPE_BINS) + 0.5) * SHAPE_BIN_SIZE
+    heatmap_kwargs = dict(colorscale="dense", x=bin_centers, y=bin_centers)
 
     fig = make_subplots(rows=1, cols=2)
     fig.add_trace(
-        go.Histogram2d(
-            x=np.log10(cube["details.width"]),
-            y=np.log10(cube["details.height"]),
+        go.Heatmap(
+            z=histograms["width_height"],
             colorbar=dict(len=1, x=0.45),
-            **hist_kwargs,
+            **heatmap_kwargs,
         ),
         row=1, col=1,
     )
@@ -887,11 +820,10 @@ def update_file_shape_chart(start_date, end_date, country_value, toggle):
     fig.update_yaxes(title_text="Spatial Y pixels [log]", row=1, col=1)
 
     fig.add_trace(
-        go.Histogram2d(
-            x=np.log10(cube["details.width"]),
-            y=np.log10(cube["details.depth"]),
+        go.Heatmap(
+            z=histograms["width_depth"],
             colorbar=dict(len=1, x=1),
-            **hist_kwargs,
+            **heatmap_kwargs,
         ),
         row=1, col=2,
     )
@@ -901,27 +833,22 @@ def update_file_shape_chart(start_date, end_date, country_value, toggle):
     fig.update_layout(
         xaxis=dict(autorangeoptions=dict(clipmin=0, clipmax=5)),
         yaxis=dict(autorangeoptions=dict(clipmin=0, clipmax=5)),
-        template=theme,
+        template="none",
     )
     return fig
 
 
 @app.callback(
-    Output("action-bar", "figure"),
+    Output("action-bar-data", "data"),
     [
         Input("date-picker", "start_date"),
         Input("date-picker", "end_date"),
         Input("country-item", "value"),
-        Input(ThemeSwitchAIO.ids.switch("theme"), "value"),
     ],
 )
-def update_action_bar_chart(start_date, end_date, country_value, toggle):
-    theme = get_theme(toggle)
-    mask = filter_by_country(entries_df, country_value)
-    select_entries = entries_df[
-        (entries_df["datetime"] >= start_date) & (entries_df["datetime"] <= end_date) & mask
-    ]
-    actions = select_entries.action.value_counts()
+@cached_figure
+def update_action_bar_chart(start_date, end_date, country_value):
+    actions = cube_counts(daily_cube, daily_cube_country_index, "action", start_date, end_date, country_value)
 
     plot_action_names = [
         "spectralProfileGeneration",
@@ -949,12 +876,88 @@ def update_action_bar_chart(start_date, end_date, country_value, toggle):
     fig.update_layout(
         barmode="stack",
         barnorm="percent",
-        template=theme,
+        template="none",
         legend=dict(orientation="h", yanchor="bottom", y=1.02, xanchor="right", x=1),
     )
     fig.update_xaxes(title_text="%")
     return fig
 
+# ---------------------------------------------------------------------------
+# Clientside: theme and font styling of the figures
+# ---------------------------------------------------------------------------
+# Every figure callback above stores a theme-neutral figure in a dcc.Store
+# ("<graph id>-data"), keyed only on the data inputs. The clientside callbacks
+# below copy it into the graph with the Plotly template of the current theme
+# (from the "figure-templates" store) and, on the Users tab, the font-size
+# inputs applied. Theme flips and font changes never reach the server.
+STYLE_FIGURE_JS = """
+function(figure, templates, lightTheme, labelSize, legendSize, xTickSize, yTickSize) {
+    if (!figure || !templates) {
+        return window.dash_clientside.no_update;
+    }
+    var fig = JSON.parse(JSON.stringify(figure));
+    fig.layout = fig.layout || {};
+    fig.layout.template = templates[lightTheme ? "light" : "dark"];
+
+    function setSize(path, size) {
+        if (size === null || size === undefined) {
+            return;
+        }
+        var node = fig.layout;
+        for (var i = 0; i < path.length; i++) {
+            node[path[i]] = node[path[i]] || {};
+            node = node[path[i]];
+        }
+        node.size = size;
+    }
+
+    setSize(["legend", "font"], legendSize);
+    setSize(["xaxis", "title", "font"], labelSize);
+    setSize(["xaxis", "tickfont"], xTickSize);
+    setSize(["yaxis", "title", "font"], labelSize);
+    setSize(["yaxis", "tickfont"], yTickSize);
+    if (fig.layout.yaxis2) {  // cumulative axis of the secondary-y charts
+        setSize(["yaxis2", "title", "font"], labelSize);
+        setSize(["yaxis2", "tickfont"], yTickSize);
+    }
+    return fig;
+}
+"""
+
+USERS_GRAPH_IDS = ["users-unique-IP", "users-uuid", "users-active-IP", "users-session"]
+FIGURE_GRAPH_IDS = [
+    "country-map",
+    "country-pie",
+    "country-other",
+    *USERS_GRAPH_IDS,
+    "version-pie",
+    "os-pie",
+    "os_detail-pie",
+    "file-type-pie",
+    "file-size-pie",
+    "file-size-bar",
+    "file-shape",
+    "action-bar",
+]
+FONT_SIZE_INPUTS = [
+    Input("label-fontsize", "value"),
+    Input("legend-fontsize", "value"),
+    Input("x-tick-fontsize", "value"),
+    Input("y-tick-fontsize", "value"),
+]
+
+for _graph_id in FIGURE_GRAPH_IDS:
+    app.clientside_callback(
+        STYLE_FIGURE_JS,
+        Output(_graph_id, "figure"),
+        [
+            Input(f"{_graph_id}-data", "data"),
+            Input("figure-templates", "data"),
+            Input(ThemeSwitchAIO.ids.switch("theme"), "value"),
+            *(FONT_SIZE_INPUTS if _graph_id in USERS_GRAPH_IDS else []),
+        ],
+    )
+
 # ---------------------------------------------------------------------------
 # Clientside: auto-detect OS dark mode on page load
 # ---------------------------------------------------------------------------
@@ -0,0 +1,50 @@
+"""
+countries.py — Country code lookup table for the CARTA telemetry data.
+
+The telemetry only records ISO 3166-1 alpha-2 codes. `preprocess_df.py`
+adds the display name and the alpha-3 code (used by the country map) by
+mapping the code columns through one table built from `pycountry_convert`,
+instead of calling it once per row; the dashboard then reads both from the
+processed data and never calls `pycountry_convert` itself.
+"""
+
+import functools
+
+import pandas as pd
+from pycountry_convert import (
+    country_name_to_country_alpha3,
+    map_country_alpha2_to_country_alpha3,
+    map_country_alpha2_to_country_name,
+)
+
+# alpha-2 code -> display name replacing the pycountry_convert one
+NAME_OVERRIDES = {
+    "TW": "Taiwan",
+}
+
+
+@functools.lru_cache(maxsize=None)
+def country_table() -> pd.DataFrame:
+    """Alpha-2 code -> `name` and `alpha3`, one row per known country."""
+    alpha2_to_alpha3 = map_country_alpha2_to_country_alpha3()
+    rows = {}
+    for alpha2, name in map_country_alpha2_to_country_name().items():
+        name = NAME_OVERRIDES.get(alpha2, name)
+        try:
+            alpha3 = country_name_to_country_alpha3(name)
+        except KeyError:
+            alpha3 = alpha2_to_alpha3.get(alpha2)
+        rows[alpha2] = (name, alpha3)
+    return pd.DataFrame.from_dict(rows, orient="index", columns=["name", "alpha3"])
+
+
+def add_country_columns(df, alpha3: bool = False):
+    """Add `country` (and `countryAlpha3` if *alpha3*) from the `countryCode` column.
+
+    Missing and unknown codes give a missing name.
+    """
+    table = country_table()
+    df["country"] = df["countryCode"].map(table["name"])
+    if alpha3:
+        df["countryAlpha3"] = df["countryCode"].map(table["alpha3"])
+    return df
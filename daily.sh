@@ -3,11 +3,10 @@
 working_dir=/home/acdc/telemetry_webpage
 cd ${working_dir}
 
-sh daily_mongodb_dump.sh
-sh extract_users.sh
-
 source ./venv/bin/activate
-python preprocess_df.py
+# entries/sessions/files/spectral and today's users snapshot, straight from the backup archive
+python mongo_archive.py ../mongo_backup_$(date +"%Y_%m_%d").tar.gz
+python preprocess_df.py --incremental
 python add_date_for_users.py
 deactivate
 
@@ -3,9 +3,22 @@ data.py — Data loading and global constants for the CARTA telemetry dashboard.
 """
 
 import configparser
+import os
 
 import dash_bootstrap_components as dbc
-import pandas as pd
+
+from countries import add_country_columns
+from distinct import build_distinct_index
+from helpers import build_country_index, sort_by_datetime
+from hll import SKETCH_COLUMNS, build_daily_sketches, load_sketches
+from rollup import (
+    build_daily_cube,
+    build_daily_file_shapes,
+    build_daily_file_sizes,
+    build_daily_first_seen,
+    build_daily_os_versions,
+)
+from storage import dataset_version, read_table, table_exists
 
 # ---------------------------------------------------------------------------
 # Configuration
@@ -16,6 +29,13 @@ configParser.read("config")
 
 df_dir = configParser.get("PATH", "df_dir")
 
+# Weekly/monthly Users-tab counts from HyperLogLog sketches instead of exact sets
+APPROX_DISTINCT = configParser.getboolean("SERVER", "approx_distinct", fallback=False)
+
+# Figure cache shared by the gunicorn workers (see cache.py); empty dir disables the disk store
+FIGURE_CACHE_DIR = configParser.get("SERVER", "figure_cache_dir", fallback="./figure_cache")
+FIGURE_CACHE_SIZE = configParser.getint("SERVER", "figure_cache_size", fallback=512)
+
 # ---------------------------------------------------------------------------
 # Theme constants
 # ---------------------------------------------------------------------------
@@ -42,21 +62,84 @@ SIZE_LABELS = [
 SIZE_LABEL_INDEX = {label: i for i, label in enumerate(SIZE_LABELS)}
 
 # ---------------------------------------------------------------------------
-# DataFrames  (loaded once at startup; gunicorn watches CSVs for hot-reload)
+# DataFrames  (loaded once at startup; gunicorn watches the files for hot-reload)
 # ---------------------------------------------------------------------------
 
-users_df = pd.read_csv(f"{df_dir}/processed_users.csv")
-sessions_df = pd.read_csv(f"{df_dir}/processed_sessions.csv", dtype={"OS_version": str})
-entries_df = pd.read_csv(f"{df_dir}/processed_entries.csv")
-files_df = pd.read_csv(f"{df_dir}/processed_files.csv")
-missing_data_dates = pd.read_csv(f"{df_dir}/missing_data_dates.csv")
-
-# Parse datetime columns
-users_df["datetime"] = pd.to_datetime(users_df.datetime, format="mixed")
-sessions_df["datetime"] = pd.to_datetime(sessions_df.datetime, format="mixed")
-entries_df["datetime"] = pd.to_datetime(entries_df.datetime, format="mixed")
-files_df["datetime"] = pd.to_datetime(files_df.datetime, format="mixed")
-missing_data_dates["datetime"] = pd.to_datetime(missing_data_dates.datetime)
+# Written by preprocess_df.py, or the CSVs of an older run. Sorted by datetime
+# (already true for current preprocess output) so callbacks can date_slice().
+users_df = sort_by_datetime(read_table(df_dir, "processed_users"))
+sessions_df = sort_by_datetime(
+    read_table(df_dir, "processed_sessions", dtype={"OS_version": str})
+)
+entries_df = sort_by_datetime(read_table(df_dir, "processed_entries"))
+files_df = sort_by_datetime(read_table(df_dir, "processed_files"))
+missing_data_dates = sort_by_datetime(read_table(df_dir, "missing_data_dates"))
+
+# Stamp of the loaded files; part of every figure cache key
+DATA_VERSION = dataset_version(df_dir)
+
+# Country name -> ISO alpha-3 code for the country map; processed data of an
+# older preprocessing run has no countryAlpha3 column and is looked up instead
+if "countryAlpha3" not in users_df.columns:
+    add_country_columns(users_df, alpha3=True)
+country_alpha3 = dict(
+    users_df[["country", "countryAlpha3"]].dropna().drop_duplicates("country").itertuples(index=False)
+)
+
+# Pre-aggregated per-day counts written by preprocess_df.py; rebuilt here if an
+# older processed_data directory does not have it yet.
+if table_exists(df_dir, "daily_cube"):
+    daily_cube = sort_by_datetime(read_table(df_dir, "daily_cube", dtype={"value": str}), "date")
+else:
+    daily_cube = build_daily_cube(
+        {"entries": entries_df, "sessions": sessions_df, "files": files_df, "users": users_df}
+    )
+
+# Per-day session counts per platform, OS and OS version for the OS detail chart
+if table_exists(df_dir, "daily_os_versions"):
+    daily_os_versions = sort_by_datetime(
+        read_table(df_dir, "daily_os_versions", dtype={"OS_version": str}), "date"
+    )
+else:
+    daily_os_versions = build_daily_os_versions(sessions_df)
+
+# Per-day file type x size label counts for the file-size charts
+if table_exists(df_dir, "daily_file_sizes"):
+    daily_file_sizes = sort_by_datetime(read_table(df_dir, "daily_file_sizes"), "date")
+else:
+    daily_file_sizes = build_daily_file_sizes(files_df)
+
+# Per-day log-shape histograms of the 3D cubes opened, for the file-shape chart
+if table_exists(df_dir, "daily_file_shapes"):
+    daily_file_shapes = sort_by_datetime(read_table(df_dir, "daily_file_shapes"), "date")
+else:
+    daily_file_shapes = build_daily_file_shapes(files_df)
+
+# Country code -> row positions of the daily tables, for rollup.select_days()
+daily_cube_country_index = build_country_index(daily_cube)
+daily_os_versions_country_index = build_country_index(daily_os_versions)
+daily_file_sizes_country_index = build_country_index(daily_file_sizes)
+daily_file_shapes_country_index = build_country_index(daily_file_shapes)
+
+# Per-day counts of newly seen IPs and uuids for the Users-tab growth charts
+if table_exists(df_dir, "daily_first_seen"):
+    daily_first_seen = sort_by_datetime(read_table(df_dir, "daily_first_seen"), "date")
+else:
+    daily_first_seen = build_daily_first_seen(entries_df, users_df)
+
+# Per-day distinct IP / session codes for the Users-tab charts
+ip_index = build_distinct_index(entries_df, "ipHash")
+session_index = build_distinct_index(entries_df, "sessionId")
+
+# Daily HyperLogLog sketches, only loaded when approximate mode is on
+ip_sketches = session_sketches = None
+if APPROX_DISTINCT:
+    if os.path.exists(f"{df_dir}/hll_sketches.npz"):
+        _sketches = load_sketches(f"{df_dir}/hll_sketches.npz")
+    else:
+        _sketches = {c: build_daily_sketches(entries_df, c) for c in SKETCH_COLUMNS}
+    ip_sketches = _sketches["ipHash"]
+    session_sketches = _sketches["sessionId"]
 
 # ---------------------------------------------------------------------------
 # Computed statistics
@@ -0,0 +1,127 @@
+"""
+distinct.py — Exact distinct-count engine for the Users-tab charts.
+
+`ipHash` / `sessionId` are factorized into integer codes once at load time and
+reduced to per-day sorted code arrays. Daily, weekly and monthly distinct
+counts are then answered with vectorized NumPy merges
+over that much smaller table, instead of a Python lambda per resample bucket
+over every entry. With a *window* (see `helpers.period_window`) only the
+days inside it are merged. As with `unique().size`, a missing value counts
+as one more distinct value in its bucket, like the missing-data detector of
+`preprocess_df.py` counts it.
+"""
+
+import numpy as np
+import pandas as pd
+
+from helpers import resample_buckets
+from hll import merged_estimates
+
+# ---------------------------------------------------------------------------
+# Index construction (once per worker, in data.py)
+# ---------------------------------------------------------------------------
+
+
+def build_distinct_index(df, column: str) -> dict:
+    """Reduce *df* to the distinct (day, countryCode, code) triples of *column*.
+
+    Returns a dict of NumPy arrays:
+
+    days : DatetimeIndex
+        Every day with at least one row, ascending.
+    day, code : ndarray
+        Distinct (day position, code) pairs over all countries, sorted by day
+        then code — i.e. one sorted code array per day, concatenated.
+    countries : Index
+        Country codes, referenced by `c_country`.
+    c_day, c_country, c_code : ndarray
+        Distinct (day, country, code) triples, sorted by day, for queries
+        restricted to one country.
+    """
+    # missing values (NaN, or MISSING_CODE of a code column) get a code of their own
+    codes, _ = pd.factorize(df[column], use_na_sentinel=False)
+    day_values, days = pd.factorize(df["datetime"].dt.floor("D"), sort=True)
+    country_codes, countries = pd.factorize(df["countryCode"])
+
+    triples = pd.DataFrame(
+        {"day": day_values, "country": country_codes, "code": codes}
+    ).drop_duplicates()
+    triples.sort_values(["day", "country", "code"], inplace=True)
+
+    pairs = triples[["day", "code"]].drop_duplicates()
+    pairs.sort_values(["day", "code"], inplace=True)
+
+    return {
+        "days": pd.DatetimeIndex(days),
+        "day": pairs["day"].to_numpy(),
+        "code": pairs["code"].to_numpy(),
+        "countries": pd.Index(countries),
+        "c_day": triples["day"].to_numpy(),
+        "c_country": triples["country"].to_numpy(),
+        "c_code": triples["code"].to_numpy(),
+    }
+
+
+# ---------------------------------------------------------------------------
+# Queries (per callback)
+# ---------------------------------------------------------------------------
+
+
+def _window_days(index: dict, window) -> tuple:
+    """Day positions ``(lo, hi)`` of the days with ``start <= day < stop``."""
+    if window is None:
+        return 0, len(index["days"])
+    lo, hi = index["days"].searchsorted(window)
+    return int(lo), int(hi)
+
+
+def _select_pairs(index: dict, country_value: str, window=None):
+    """Return the distinct (day position, code) pairs for a country filter.
+
+    Pairs are sorted by day, so a *window* is a slice found by binary search.
+    """
+    lo, hi = _window_days(index, window)
+    if country_value == "":
+        first, last = index["day"].searchsorted([lo, hi])
+        return index["day"][first:last], index["code"][first:last]
+    if country_value not in index["countries"]:
+        empty = np.empty(0, dtype=np.int64)
+        return empty, empty
+    first, last = index["c_day"].searchsorted([lo, hi])
+    c_day, c_code = index["c_day"][first:last], index["c_code"][first:last]
+    selected = index["c_country"][first:last] == index["countries"].get_loc(country_value)
+    return c_day[selected], c_code[selected]
+
+
+def distinct_counts(index: dict, period: str, country_value: str = "", window=None) -> pd.Series:
+    """Number of distinct codes per resample bucket.
+
+    Equivalent to ``resample(period, on="datetime").apply(lambda x:
+    x[column].unique().size)`` over the country-filtered rows.
+    """
+    day, code = _select_pairs(index, country_value, window)
+    if len(day) == 0:
+        return pd.Series(dtype=np.int64, index=pd.DatetimeIndex([]))
+
+    used_days, day_pos = np.unique(day, return_inverse=True)
+    labels, bucket_of_day = resample_buckets(index["days"][used_days], period)
+    bucket = bucket_of_day[day_pos].astype(np.int64)
+
+    # (bucket, code) packed into one int64 so a single np.unique dedupes it
+    n_codes = int(code.max()) + 1
+    keys = np.unique(bucket * n_codes + code)
+    counts = np.bincount(keys // n_codes, minlength=len(labels))
+    return pd.Series(counts, index=labels)
+
+
+def period_distinct_counts(index: dict, period: str, country_value: str = "", sketches=None, window=None):
+    """Distinct counts per resample bucket and whether they are approximate.
+
+    With *sketches* (approximate mode), weekly and monthly counts over all
+    countries are merged from the daily HyperLogLog sketches; daily and
+    per-country counts are small enough to stay exact.
+    """
+    if sketches is not None and country_value == "" and period != "d":
+        return merged_estimates(sketches, period, window), True
+    return distinct_counts(index, period, country_value, window), False
+
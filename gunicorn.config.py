@@ -1,4 +1,4 @@
 bind='0.0.0.0:8051'
 pidfile='gunicorn_pid'
 reload=True
-reload_extra_files=['./processed_data/missing_data_dates.csv', './processed_data/processed_entries.csv', './processed_data/processed_files.csv', './processed_data/processed_sessions.csv', './processed_data/processed_spectral.csv', './processed_data/processed_users.csv']
\ No newline at end of file
+reload_extra_files=['./processed_data/daily_cube.parquet', './processed_data/daily_file_shapes.parquet', './processed_data/daily_file_sizes.parquet', './processed_data/daily_first_seen.parquet', './processed_data/daily_os_versions.parquet', './processed_data/hll_sketches.npz', './processed_data/missing_data_dates.parquet', './processed_data/processed_entries.parquet', './processed_data/processed_files.parquet', './processed_data/processed_sessions.parquet', './processed_data/processed_spectral.parquet', './processed_data/processed_users.parquet']
\ No newline at end of file
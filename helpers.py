@@ -5,6 +5,9 @@ helpers.py — Reusable utility functions for the CARTA telemetry dashboard.
 import calendar
 from datetime import datetime, timedelta
 
+import numpy as np
+import pandas as pd
+
 
 # ---------------------------------------------------------------------------
 # Theme
@@ -15,6 +18,15 @@ def get_theme(toggle: bool) -> str:
     return "cosmo" if toggle else "cyborg"
 
 
+def clear_template_colors(fig) -> None:
+    """Drop the marker colors plotly express copies from the server-side template.
+
+    Figures are themed in the browser; traces without an explicit color take
+    theirs from the colorway of the template applied there.
+    """
+    fig.update_traces(marker_color=None)
+
+
 # ---------------------------------------------------------------------------
 # Period / time-series helpers (used by Users-tab callbacks)
 # ---------------------------------------------------------------------------
@@ -41,10 +53,51 @@ def get_period_params(period_value: str) -> tuple:
         return "d", 5, 5, timedelta(days=0)
 
 
-def get_missing_data_annotations(missing_data_dates, period: str):
-    """Return the index dates that have at least one missing-data entry."""
+def get_missing_data_annotations(missing_data_dates, period: str, window=None):
+    """Return the index dates that have at least one missing-data entry.
+
+    With a *window* from period_window(), only the dates inside it.
+    """
     resampled = missing_data_dates.resample(period, on="datetime").size()
-    return resampled[resampled.values > 0].keys()
+    dates = resampled[resampled.values > 0].keys()
+    if window is not None:
+        dates = dates[(dates >= window[0]) & (dates < window[1])]
+    return dates
+
+
+def period_window(start_date: str, end_date: str, period: str) -> tuple:
+    """Extend a date range to the whole resample buckets it overlaps.
+
+    Returns ``(start, stop)``: the first day of the bucket holding
+    *start_date* and the day after the bucket holding *end_date*, so rows
+    with ``start <= datetime < stop`` give the same per-bucket values as the
+    whole history for every bucket shown. "W" buckets end on Sunday.
+    """
+    start = pd.Timestamp(start_date).floor("D")
+    end = pd.Timestamp(end_date).floor("D")
+    if period == "MS":
+        start = start.replace(day=1)
+        end = end.replace(day=1) + pd.DateOffset(months=1) - pd.Timedelta(days=1)
+    elif period == "W":
+        start -= pd.Timedelta(days=start.weekday())
+        end += pd.Timedelta(days=6 - end.weekday())
+    return start, end + pd.Timedelta(days=1)
+
+
+def resample_buckets(days, period: str):
+    """Map each day of a sorted DatetimeIndex to its resample bucket.
+
+    Returns the bucket labels — identical to `Series.resample(period)` over
+    the same days, including empty buckets — and the bucket position of each
+    day. "W" bins are labelled by their (inclusive) right edge, "MS" and "d"
+    bins by their left edge.
+    """
+    labels = pd.Series(0, index=days).resample(period).size().index
+    if period == "W":
+        positions = labels.searchsorted(days, side="left")
+    else:
+        positions = labels.searchsorted(days, side="right") - 1
+    return labels, positions
 
 
 def compute_end_date(end_date: str) -> str:
@@ -58,14 +111,66 @@ def compute_end_date(end_date: str) -> str:
 # DataFrame filtering
 # ---------------------------------------------------------------------------
 
-def filter_by_country(df, country_value: str):
-    """Return a boolean mask that selects rows matching the country filter.
+def sort_by_datetime(df, column: str = "datetime"):
+    """Return *df* sorted by *column*, or *df* itself if it already is."""
+    if df[column].is_monotonic_increasing:
+        return df
+    return df.sort_values(column, kind="stable", ignore_index=True)
+
+
+def date_offsets(df, start_date, end_date, column: str = "datetime") -> tuple:
+    """Row offsets ``(start, stop)`` of ``start_date <= df[column] <= end_date``.
+
+    *df* must be sorted by *column* (see sort_by_datetime); the range is
+    found with two binary searches. A date of None leaves that end open.
+    """
+    values = df[column].to_numpy()
+    start = 0
+    stop = len(values)
+    if start_date is not None:
+        start = values.searchsorted(np.datetime64(pd.Timestamp(start_date)), side="left")
+    if end_date is not None:
+        stop = values.searchsorted(np.datetime64(pd.Timestamp(end_date)), side="right")
+    return start, stop
+
+
+def date_slice(df, start_date, end_date, column: str = "datetime"):
+    """Return the rows of *df* with ``start_date <= df[column] <= end_date``.
+
+    The result is a positional slice that shares memory with *df*.
+    """
+    start, stop = date_offsets(df, start_date, end_date, column)
+    return df.iloc[start:stop]
+
 
-    When *country_value* is empty string (''), all rows are selected.
+def build_country_index(df) -> dict:
+    """Map each country code of *df* to the ascending row positions holding it.
+
+    Built once per table in data.py. Rows without a country code are only
+    selected by the "All" filter, as before.
     """
+    codes, countries = pd.factorize(df["countryCode"])
+    order = np.argsort(codes, kind="stable")
+    bounds = np.searchsorted(codes[order], np.arange(len(countries) + 1))
+    return {country: order[bounds[i]:bounds[i + 1]] for i, country in enumerate(countries)}
+
+
+def select_rows(df, country_index: dict, country_value: str, start_date=None, end_date=None,
+                column: str = "datetime"):
+    """Return the rows of *df* matching the country filter and date range.
+
+    *df* must be sorted by *column* and *country_index* built from it with
+    build_country_index(). When *country_value* is empty string ('') all
+    countries are selected and the result is a plain date slice. Otherwise
+    the rows of that country inside the range are a contiguous run of its
+    sorted positions, found with two more binary searches.
+    """
+    start, stop = date_offsets(df, start_date, end_date, column)
     if country_value == "":
-        return df["countryCode"].isnull() | df["countryCode"].notnull()
-    return df["countryCode"] == country_value
+        return df.iloc[start:stop]
+    positions = country_index.get(country_value, np.empty(0, dtype=np.intp))
+    first, last = positions.searchsorted([start, stop])
+    return df.iloc[positions[first:last]]
 
 
 # ---------------------------------------------------------------------------
@@ -86,17 +191,9 @@ def apply_date_xaxis(fig, start_date: str, new_end_date: str) -> None:
     )
 
 
-def apply_standard_legend(fig, legend_fontsize: int) -> None:
+def apply_standard_legend(fig) -> None:
     """Pin the legend above the chart area (bottom-left anchor)."""
-    fig.update_layout(
-        legend=dict(
-            yanchor="bottom",
-            y=1.00,
-            xanchor="left",
-            x=0.9,
-            font=dict(size=legend_fontsize),
-        )
-    )
+    fig.update_layout(legend=dict(yanchor="bottom", y=1.00, xanchor="left", x=0.9))
 
 
 def add_incomplete_data_annotations(fig, anno_dates, day_shift, anno_y, fontsize) -> None:
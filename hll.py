@@ -0,0 +1,138 @@
+"""
+hll.py — HyperLogLog sketches for approximate distinct counts.
+
+`preprocess_df.py` stores one sketch of `ipHash` and one of `sessionId` per
+day next to the processed data. Merging the sketches of a week or a month is
+an element-wise max over a fixed number of registers, so the cost of a
+weekly/monthly distinct count no longer grows with the number of hashes seen.
+Enabled with `approx_distinct: True` in the [SERVER] section of `config`.
+
+tests/test_hll.py checks the estimates against exact counts.
+"""
+
+import os
+
+import numpy as np
+import pandas as pd
+
+from helpers import resample_buckets
+from schema import has_value
+
+PRECISION = 12  # 2**12 registers per sketch
+N_REGISTERS = 1 << PRECISION
+STANDARD_ERROR = 1.04 / np.sqrt(N_REGISTERS)  # ~1.6 %
+
+SKETCH_COLUMNS = ["ipHash", "sessionId"]
+
+
+# ---------------------------------------------------------------------------
+# Sketch construction
+# ---------------------------------------------------------------------------
+
+
+def _bit_length(values: np.ndarray) -> np.ndarray:
+    """Vectorized int.bit_length() for uint64 arrays."""
+    values = values.copy()
+    length = np.zeros(values.shape, dtype=np.uint8)
+    for shift in (32, 16, 8, 4, 2, 1):
+        wide = values >= (np.uint64(1) << np.uint64(shift))
+        values[wide] >>= np.uint64(shift)
+        length[wide] += shift
+    return length + (values > 0)
+
+
+def build_daily_sketches(df, column: str):
+    """Build one HyperLogLog sketch of *column* per day.
+
+    Returns the days (DatetimeIndex, ascending) and a uint8 register matrix
+    of shape (n_days, N_REGISTERS).
+    """
+    rows = df[has_value(df[column])]
+    day_values, days = pd.factorize(rows["datetime"].dt.floor("D"), sort=True)
+
+    hashes = pd.util.hash_array(rows[column].to_numpy())
+    register = (hashes >> np.uint64(64 - PRECISION)).astype(np.int64)
+    remainder = hashes & np.uint64((1 << (64 - PRECISION)) - 1)
+    rank = (64 - PRECISION + 1) - _bit_length(remainder)
+
+    # keep the highest rank per (day, register)
+    highest = pd.Series(rank).groupby(day_values * N_REGISTERS + register).max()
+    registers = np.zeros(len(days) * N_REGISTERS, dtype=np.uint8)
+    registers[highest.index.to_numpy()] = highest.to_numpy()
+    return pd.DatetimeIndex(days), registers.reshape(len(days), N_REGISTERS)
+
+
+def save_sketches(path: str, df, since=None) -> None:
+    """Write the daily sketches of every SKETCH_COLUMNS entry to one .npz file.
+
+    With *since*, only the days from *since* on are rebuilt from *df*; the
+    earlier days are kept from the existing file.
+    """
+    previous = load_sketches(path) if since is not None and os.path.exists(path) else {}
+    if previous:
+        df = df[df["datetime"] >= since]
+    arrays = {}
+    for column in SKETCH_COLUMNS:
+        days, registers = build_daily_sketches(df, column)
+        if previous:
+            old_days, old_registers = previous[column]
+            kept = old_days < since
+            days = old_days[kept].append(days)
+            registers = np.concatenate([old_registers[kept], registers])
+        arrays[f"{column}_days"] = days.to_numpy(dtype="datetime64[ns]")
+        arrays[f"{column}_registers"] = registers
+    np.savez_compressed(path, **arrays)
+
+
+def load_sketches(path: str) -> dict:
+    """Read a file written by save_sketches(); column -> (days, registers)."""
+    with np.load(path) as archive:
+        return {
+            column: (
+                pd.DatetimeIndex(archive[f"{column}_days"]),
+                archive[f"{column}_registers"],
+            )
+            for column in SKETCH_COLUMNS
+        }
+
+
+# ---------------------------------------------------------------------------
+# Estimation
+# ---------------------------------------------------------------------------
+
+
+def estimate(registers: np.ndarray) -> np.ndarray:
+    """Cardinality estimate for each row of a register matrix."""
+    registers = np.atleast_2d(registers)
+    alpha = 0.7213 / (1 + 1.079 / N_REGISTERS)
+    raw = alpha * N_REGISTERS**2 / np.sum(np.exp2(-registers.astype(np.float64)), axis=1)
+
+    # small-range correction: linear counting while registers are still empty
+    zeros = np.sum(registers == 0, axis=1)
+    small = (raw <= 2.5 * N_REGISTERS) & (zeros > 0)
+    raw[small] = N_REGISTERS * np.log(N_REGISTERS / zeros[small])
+    return raw
+
+
+def merged_estimates(sketches, period: str, window=None) -> pd.Series:
+    """Approximate distinct count per resample bucket from daily sketches.
+
+    Same index as `distinct.distinct_counts()` for the whole dataset, or
+    for the days with ``start <= day < stop`` of a *window*.
+    """
+    days, registers = sketches
+    if window is not None:
+        lo, hi = days.searchsorted(window)
+        days, registers = days[lo:hi], registers[lo:hi]
+    if len(days) == 0:
+        return pd.Series(dtype=np.int64, index=pd.DatetimeIndex([]))
+
+    labels, bucket_of_day = resample_buckets(days, period)
+    # days are sorted, so each non-empty bucket is a contiguous block of rows
+    used, starts = np.unique(bucket_of_day, return_index=True)
+    merged = np.maximum.reduceat(registers, starts, axis=0)
+
+    counts = np.zeros(len(labels), dtype=np.int64)
+    counts[used] = np.rint(estimate(merged)).astype(np.int64)
+    return pd.Series(counts, index=labels)
+
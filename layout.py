@@ -5,10 +5,12 @@ layout.py — Dash layout components for the CARTA telemetry dashboard.
 from datetime import datetime
 
 import dash_bootstrap_components as dbc
+import plotly.io as pio
 from dash import dcc, html
 from dash_bootstrap_templates import ThemeSwitchAIO
 
 from data import opt_in_frac, users_df
+from helpers import get_theme
 
 # ---------------------------------------------------------------------------
 # Opt-in disclaimer (used in several tab descriptions)
@@ -21,6 +23,16 @@ OPT_IN_DISCLAIMER = f"{OPT_IN_PCT} users who allowed to share the telemetry data
 # Tab content components
 # ---------------------------------------------------------------------------
 
+
+def figure_graph(graph_id: str) -> tuple:
+    """A graph and the store its server callback writes the figure to.
+
+    The clientside styling callbacks in callbacks.py copy the stored figure
+    into the graph with the theme (and font sizes) applied.
+    """
+    return dcc.Graph(id=graph_id), dcc.Store(id=f"{graph_id}-data")
+
+
 home_tab = html.Div(
     [
         html.H1("CARTA"),
@@ -42,9 +54,9 @@ country_tab = html.Div(
     [
         dbc.Row(
             [
-                dcc.Graph(id="country-pie"),
-                dcc.Graph(id="country-map"),
-                dbc.Row([dcc.Graph(id="country-other")]),
+                *figure_graph("country-pie"),
+                *figure_graph("country-map"),
+                dbc.Row([*figure_graph("country-other")]),
             ],
             class_name="country-row1",
         )
@@ -64,6 +76,12 @@ users_tab = html.Div(
                     labelClassName="btn btn-outline-primary",
                     labelCheckedClassName="active",
                 ),
+                dbc.Switch(
+                    id="full-history-switch",
+                    label="Full history",
+                    value=False,
+                    style={"display": "inline-block", "marginLeft": "20px"},
+                ),
                 html.Div(
                     [
                         html.Label("Label Font Size:"),
@@ -225,6 +243,14 @@ def serve_layout():
         [
             # Fires once on page load (data=None); triggers OS dark-mode detection
             dcc.Store(id="os-theme-store", storage_type="memory"),
+            # Plotly templates the clientside callbacks apply to every figure
+            dcc.Store(
+                id="figure-templates",
+                data={
+                    "light": pio.templates[get_theme(True)].to_plotly_json(),
+                    "dark": pio.templates[get_theme(False)].to_plotly_json(),
+                },
+            ),
             dbc.Container(
                 [
                     html.Div(
@@ -0,0 +1,94 @@
+"""
+measure_worker_memory.py — Resident memory of the dashboard's gunicorn workers.
+
+Starts `gunicorn main:server` with 1, 4 and 8 workers in turn, waits until
+every worker has finished loading the data, and prints each worker's RSS and
+PSS from /proc/<pid>/smaps_rollup. PSS splits shared pages (the memory-mapped
+column store, the page cache of the code) between the processes mapping
+them, so the PSS total is what the workers cost the host together.
+
+Run from the directory holding `config` and the processed data (Linux only):
+
+    python measure_worker_memory.py [worker counts ...]
+"""
+
+import subprocess
+import sys
+import time
+import urllib.request
+
+PORT = 8099
+SETTLE_SECONDS = 3  # RSS must stay flat this long before a worker counts as loaded
+TIMEOUT_SECONDS = 300
+
+
+def _children(pid: int) -> list:
+    with open(f"/proc/{pid}/task/{pid}/children") as f:
+        return [int(child) for child in f.read().split()]
+
+
+def _memory_kb(pid: int) -> dict:
+    """Rss / Pss / Shared / Private in kB from smaps_rollup."""
+    fields = {}
+    with open(f"/proc/{pid}/smaps_rollup") as f:
+        for line in f:
+            parts = line.split()
+            if len(parts) == 3 and parts[2] == "kB":
+                fields[parts[0].rstrip(":")] = int(parts[1])
+    return {
+        "rss": fields["Rss"],
+        "pss": fields["Pss"],
+        "shared": fields["Shared_Clean"] + fields["Shared_Dirty"],
+        "private": fields["Private_Clean"] + fields["Private_Dirty"],
+    }
+
+
+def _wait_until_loaded(master: int, workers: int) -> list:
+    """Return the worker pids once all of them answer and their RSS is stable."""
+    deadline = time.time() + TIMEOUT_SECONDS
+    last, stable_since = None, None
+    while time.time() < deadline:
+        time.sleep(0.5)
+        pids = sorted(_children(master))
+        if len(pids) != workers:
+            continue
+        try:
+            urllib.request.urlopen(f"http://127.0.0.1:{PORT}/", timeout=5).read()
+        except OSError:
+            continue
+        rss = [_memory_kb(pid)["rss"] for pid in pids]
+        if rss != last:
+            last, stable_since = rss, time.time()
+        elif time.time() - stable_since >= SETTLE_SECONDS:
+            return pids
+    raise TimeoutError(f"{workers} workers did not finish loading in {TIMEOUT_SECONDS}s")
+
+
+def measure(workers: int) -> None:
+    server = subprocess.Popen(
+        ["gunicorn", "--workers", str(workers), "--bind", f"127.0.0.1:{PORT}", "main:server"],
+        stdout=subprocess.DEVNULL,
+        stderr=subprocess.DEVNULL,
+    )
+    try:
+        pids = _wait_until_loaded(server.pid, workers)
+        usage = [_memory_kb(pid) for pid in pids]
+    finally:
+        server.terminate()
+        server.wait()
+
+    print(f"{workers} worker(s)")
+    for pid, mem in zip(pids, usage):
+        print(
+            f"  pid {pid:7d}  RSS {mem['rss'] / 1024:7.1f} MB  PSS {mem['pss'] / 1024:7.1f} MB  "
+            f"shared {mem['shared'] / 1024:7.1f} MB  private {mem['private'] / 1024:7.1f} MB"
+        )
+    print(
+        f"  total  RSS {sum(m['rss'] for m in usage) / 1024:7.1f} MB  "
+        f"PSS {sum(m['pss'] for m in usage) / 1024:7.1f} MB"
+    )
+
+
+if __name__ == "__main__":
+    for count in [int(arg) for arg in sys.argv[1:]] or [1, 4, 8]:
+        measure(count)
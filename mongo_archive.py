@@ -0,0 +1,230 @@
+"""
+mongo_archive.py — Read a `mongodump --archive --gzip` backup without a database.
+
+`daily_mongodb_dump.sh` restores the whole backup into the local mongod and
+then scans `entries` three times and `sessions` once with `mongoexport`, and
+`extract_users.sh` restores it again for the users. This module decodes the
+archive stream directly and routes every document to its outputs in one
+pass:
+
+- entries, sessions, file_details and spectralProfileGeneration are written
+  to `{dumped_file_dir}/{name}.parquet`, which `preprocess_df.py` reads in
+  place of the CSV of the same name;
+- the users collection is written to `{users_csv_dir}/users_YYYY_MM_DD.parquet`,
+  a snapshot for `add_date_for_users.py`.
+
+Columns and filters are those of the `mongoexport` calls. Each column has
+a fixed type (FIELD_TYPES, text by default); ObjectIds and values of any
+other BSON type in a text column become their string, like `mongoexport`
+writes them. Every output is written in row groups of BATCH_SIZE rows, so
+memory stays bounded whatever the size of the archive.
+
+    python mongo_archive.py mongo_backup_YYYY_MM_DD.tar.gz
+
+Archive layout (mongo-tools `common/archive`): a little-endian magic number,
+a prelude of BSON documents (archive header, one metadata document per
+collection) closed by a terminator, then blocks of one namespace header
+followed by that collection's documents and a terminator. Blocks of
+different collections are interleaved; a header with `EOF: true` closes a
+collection. With `--gzip` the whole stream is gzip-compressed.
+"""
+
+import argparse
+import configparser
+import gzip
+import os
+import re
+import struct
+
+import bson
+import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+from bson import ObjectId
+
+DATABASE = "carta-telemetry"
+
+MAGIC_NUMBER = 0x8199E26D
+TERMINATOR = b"\xff\xff\xff\xff"
+
+# output -> (collection, required action or None, exported fields)
+OUTPUTS = {
+    "entries": ("entries", None, ["timestamp", "sessionId", "action", "countryCode", "ipHash"]),
+    "sessions": (
+        "sessions",
+        None,
+        ["id", "userId", "version", "startTime", "endTime", "duration", "backendPlatform",
+         "backendPlatformInfo.distro", "backendPlatformInfo.variant", "backendPlatformInfo.version"],
+    ),
+    "file_details": (
+        "entries",
+        "fileOpen",
+        ["timestamp", "countryCode", "details.width", "details.height", "details.depth",
+         "details.stokes"],
+    ),
+    "spectralProfileGeneration": (
+        "entries",
+        "spectralProfileGeneration",
+        ["timestamp", "countryCode", "details.profileLength", "details.regionId", "details.width",
+         "details.height", "details.depth"],
+    ),
+    "users": ("users", None, ["_id", "uuid", "countryCode", "optOut", "regionCode"]),
+}
+
+# exported field -> Parquet column type; every other field is text
+FIELD_TYPES = {
+    "timestamp": pa.int64(),
+    "startTime": pa.int64(),
+    "endTime": pa.int64(),
+    "duration": pa.int64(),
+    "details.width": pa.float64(),
+    "details.height": pa.float64(),
+    "details.depth": pa.float64(),
+    "details.stokes": pa.float64(),
+    "details.profileLength": pa.float64(),
+    "details.regionId": pa.float64(),
+    "optOut": pa.bool_(),
+}
+
+BATCH_SIZE = 100_000  # rows per output held in memory before they are written
+
+
+# ---------------------------------------------------------------------------
+# Archive stream
+# ---------------------------------------------------------------------------
+
+
+def _read_document(stream):
+    """Next raw BSON document, None for a terminator, EOFError at the end of the stream."""
+    prefix = stream.read(4)
+    if not prefix:
+        raise EOFError
+    if prefix == TERMINATOR:
+        return None
+    (length,) = struct.unpack("<i", prefix)
+    body = stream.read(length - 4)
+    if len(body) != length - 4:
+        raise ValueError("truncated BSON document in archive")
+    return prefix + body
+
+
+def iter_archive(path: str):
+    """Yield (collection, raw BSON document) for every document of DATABASE in the archive."""
+    with gzip.open(path, "rb") as stream:
+        (magic,) = struct.unpack("<I", stream.read(4))
+        if magic != MAGIC_NUMBER:
+            raise ValueError(f"{path} is not a mongodump archive")
+
+        # prelude: archive header and collection metadata, up to a terminator
+        while _read_document(stream) is not None:
+            pass
+
+        while True:
+            try:
+                header = _read_document(stream)
+            except EOFError:
+                return
+            header = bson.decode(header)
+            while (document := _read_document(stream)) is not None:
+                if header["db"] == DATABASE and not header.get("EOF"):
+                    yield header["collection"], document
+
+
+# ---------------------------------------------------------------------------
+# Routing to columns
+# ---------------------------------------------------------------------------
+
+
+def _field(document: dict, path: str):
+    value = document
+    for key in path.split("."):
+        if not isinstance(value, dict):
+            return None
+        value = value.get(key)
+    if isinstance(value, ObjectId):
+        return str(value)
+    return value
+
+
+def _to_array(values: list, type_) -> pa.Array:
+    """Column of one batch with its FIELD_TYPES type; values that do not fit it are missing."""
+    if pa.types.is_string(type_):
+        return pa.array([v if v is None or isinstance(v, str) else str(v) for v in values], type=type_)
+    if pa.types.is_boolean(type_):
+        return pa.array([v if isinstance(v, bool) else None for v in values], type=type_)
+    # int32/int64/double BSON numbers alike; numeric strings are parsed as read_csv would
+    numbers = pd.to_numeric(pd.Series(values, dtype=object), errors="coerce")
+    return pa.array(numbers, from_pandas=True).cast(type_, safe=False)
+
+
+def _schema(fields: list) -> pa.Schema:
+    return pa.schema([(field, FIELD_TYPES.get(field, pa.string())) for field in fields])
+
+
+def _flush(output: dict) -> None:
+    """Write the buffered rows of *output* as one row group and empty the buffer."""
+    columns = output["columns"]
+    if not columns[output["schema"].names[0]]:
+        return
+    arrays = [_to_array(columns[field.name], field.type) for field in output["schema"]]
+    output["writer"].write_table(pa.Table.from_arrays(arrays, schema=output["schema"]))
+    output["rows"] += len(arrays[0])
+    for values in columns.values():
+        values.clear()
+
+
+def write_outputs(path: str, dumped_file_dir: str, users_csv_dir: str, batch_size: int = BATCH_SIZE) -> None:
+    """Decode the archive once and write every OUTPUTS entry to its Parquet file."""
+    date = re.search(r"\d{4}_\d{2}_\d{2}", os.path.basename(path)).group()
+    routes = {}  # collection -> [(action or None, output)]
+    outputs = {}
+    for name, (collection, action, fields) in OUTPUTS.items():
+        if name == "users":
+            target = f"{users_csv_dir}/users_{date}.parquet"
+        else:
+            target = f"{dumped_file_dir}/{name}.parquet"
+        schema = _schema(fields)
+        outputs[name] = {
+            "target": target,
+            "schema": schema,
+            "columns": {field: [] for field in fields},
+            "rows": 0,
+            "writer": pq.ParquetWriter(f"{target}.tmp", schema, compression="zstd"),
+        }
+        routes.setdefault(collection, []).append((action, outputs[name]))
+
+    try:
+        for collection, raw in iter_archive(path):
+            if collection not in routes:
+                continue
+            document = bson.decode(raw)
+            for action, output in routes[collection]:
+                if action is not None and document.get("action") != action:
+                    continue
+                for field, values in output["columns"].items():
+                    values.append(_field(document, field))
+                if len(values) >= batch_size:
+                    _flush(output)
+        for output in outputs.values():
+            _flush(output)
+    finally:
+        for output in outputs.values():
+            output["writer"].close()
+
+    for output in outputs.values():
+        os.replace(f"{output['target']}.tmp", output["target"])
+        print(f"{output['rows']} rows -> {output['target']}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("archive", help="mongo_backup_YYYY_MM_DD.tar.gz written by mongodump --archive --gzip")
+    args = parser.parse_args()
+
+    configParser = configparser.ConfigParser()
+    configParser.read("config")
+    write_outputs(
+        args.archive,
+        configParser.get("PATH", "dumped_file_dir"),
+        configParser.get("PATH", "users_csv_dir"),
+    )
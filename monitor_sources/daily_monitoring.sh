@@ -112,7 +112,10 @@ else
     # Function to count rows (excluding header)
     count_rows() {
         local file=$1
-        if [ -f "$file" ]; then
+        if [[ "$file" == *.parquet && -f "$file" ]]; then
+            # Row count is stored in the Parquet footer
+            python3 -c 'import sys, pyarrow.parquet as pq; print(pq.ParquetFile(sys.argv[1]).metadata.num_rows)' "$file"
+        elif [ -f "$file" ]; then
             # Count total lines and subtract 1 for header
             local total_lines=$(wc -l < "$file")
             local data_rows=$((total_lines - 1))
@@ -122,14 +125,14 @@ else
         fi
     }
 
-    # Check processed_entries.csv
-    echo "📄 processed_entries.csv"
-    ENTRIES_FILE="$DATA_DIR/processed_entries.csv"
+    # Check processed_entries.parquet
+    echo "📄 processed_entries.parquet"
+    ENTRIES_FILE="$DATA_DIR/processed_entries.parquet"
     ENTRIES_ROWS=$(count_rows "$ENTRIES_FILE")
 
-    # Check processed_sessions.csv
-    echo "📄 processed_sessions.csv"
-    SESSIONS_FILE="$DATA_DIR/processed_sessions.csv"
+    # Check processed_sessions.parquet
+    echo "📄 processed_sessions.parquet"
+    SESSIONS_FILE="$DATA_DIR/processed_sessions.parquet"
     SESSIONS_ROWS=$(count_rows "$SESSIONS_FILE")
 
     # Compare with yesterday's counts
@@ -1,154 +1,577 @@
-import pandas as pd
-import numpy as np
-from datetime import datetime, timedelta, date
-from pycountry_convert import country_alpha2_to_country_name
+"""
+preprocess_df.py — Nightly preprocessing of the telemetry CSVs exported from Mongo.
+
+Processed rows are kept in monthly Parquet partitions (`storage.append_partitions`)
+together with a high-water mark, the latest raw timestamp processed from each
+collection. The served tables, the daily cube, the other daily count tables
+(OS versions, file sizes, file shapes, first-seen IPs and users), the
+HyperLogLog sketches and `missing_data_dates` are then refreshed from the
+partitions.
+
+    python preprocess_df.py                 # rebuild everything from the CSVs
+    python preprocess_df.py --incremental   # only rows newer than the high-water marks
+
+In incremental mode only the new rows go through the per-row processing, only
+the months they fall in are rewritten, and the daily tables, sketches and
+missing dates are recomputed from the first affected day on, except the
+first-seen counts, which depend on the whole history and are always rebuilt
+from the served tables. Rows that arrive with a timestamp at or below a
+high-water mark are only picked up by a full rebuild; so is the country of a
+session whose first entry is exported a day after the session itself.
+
+The exports are streamed `chunk_size` rows at a time (`[PREPROCESS]` section
+of `config`, or `--chunk-size`) and each chunk is appended to the partitions
+once processed, so the memory of the per-row stages does not grow with the
+exports.
+
+The work is split into the stages of `STAGES` (one per export, served
+table and derived table), run on a process pool of `workers` processes
+(`[PREPROCESS]` section of `config`, or `--workers`) as soon as the stages
+they depend on are done. Each running stage holds its own chunk or table,
+so fewer workers also means less memory. The time of every stage and the
+critical path are printed at the end.
+
+A day is listed in `missing_data_dates` when it has fewer distinct IPs than
+the workday or holiday threshold of its year in `missing_data_thresholds.csv`;
+the file and the holiday month-days are set in the `[PREPROCESS]` section of
+`config`.
+"""
+
+import argparse
 import configparser
+import json
+import os
+import time
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+from datetime import datetime, date
 
-configParser = configparser.ConfigParser()
-configParser.read('config')
-users_csv_dir = configParser.get('PATH', 'users_csv_dir')
-dumped_file_dir = configParser.get('PATH', 'dumped_file_dir')
+import pandas as pd
+import numpy as np
+import pyarrow.parquet as pq
+
+from countries import add_country_columns
+from helpers import date_slice
+from hll import SKETCH_COLUMNS, save_sketches
+from rollup import (
+    CUBE_DIMENSIONS,
+    build_daily_cube,
+    build_daily_file_shapes,
+    build_daily_file_sizes,
+    build_daily_first_seen,
+    build_daily_os_versions,
+)
+from storage import (
+    append_partitions,
+    clear_partitions,
+    read_partitions,
+    read_table,
+    truncate_partitions,
+    write_table,
+)
 
-today = datetime.today().date()
-# today = date(2025, 2, 28)
 init_date = date(2021, 12, 1)
 
-#### load data ####
-# Load CSV data
-users_df = pd.read_csv(f"{dumped_file_dir}/users_with_date.csv")
-sessions_df = pd.read_csv(f"{dumped_file_dir}/sessions.csv")
-entries_df = pd.read_csv(f"{dumped_file_dir}/entries.csv")
-files_df = pd.read_csv(f"{dumped_file_dir}/file_details.csv")
-spectral_df = pd.read_csv(f"{dumped_file_dir}/spectralProfileGeneration.csv")
-
-# process date information 
-users_df['datetime'] = pd.to_datetime(users_df.date, format='mixed')
-sessions_df['datetime'] = pd.to_datetime(sessions_df.startTime, unit='ms')
-entries_df['datetime'] = pd.to_datetime(entries_df.timestamp, unit='ms')
-files_df['datetime'] = pd.to_datetime(files_df.timestamp, unit='ms')
-spectral_df['datetime'] = pd.to_datetime(spectral_df.timestamp, unit='ms')
-
-users_df.drop(columns=['date'], inplace=True)
-sessions_df.drop(columns=['startTime'], inplace=True)
-entries_df.drop(columns=['timestamp'], inplace=True)
-files_df.drop(columns=['timestamp'], inplace=True)
-spectral_df.drop(columns=['timestamp'], inplace=True)
-
-# process file type
-r_width = files_df['details.width'] > 1
-r_height = files_df['details.height'] > 1
-r_depth = files_df['details.depth'] > 1
-r_stokes = files_df['details.stokes'] > 1
-
-stokes_4d = r_width & r_height & r_depth & r_stokes
-stokes_3d = r_width & r_height & r_stokes & ~stokes_4d
-three_dim = r_width & r_height & r_depth & ~stokes_4d  & ~stokes_3d
-two_dim = r_width & r_height & ~stokes_4d  & ~stokes_3d & ~three_dim
-
-files_df.loc[two_dim ,'file_type'] = '2D'
-files_df.loc[three_dim ,'file_type'] = '3D'
-files_df.loc[stokes_3d ,'file_type'] = '2D+Stokes'
-files_df.loc[stokes_4d ,'file_type'] = '3D+Stokes'
-
-files_df['fileSize'] = files_df['details.width'] * files_df['details.height'] * files_df['details.depth'] * files_df['details.stokes'] * 4 / 1024**2 # in MB
-
-size_range = [0, 1, 10, 100, 1024, 10240, 102400, 1024**2, 1024**2*10] # in MB
-size_label = ["<1MB", "1MB-10MB", "10MB-100MB", "100MB-1GB", "1GB-10GB", "10GB-100GB", "100GB-1TB", "1TB-10TB"] # in MB
-
-for i in range(len(size_range)-1):
-    r = (files_df['fileSize'] > size_range[i]) & (files_df['fileSize'] <= size_range[i+1])
-    files_df.loc[r, 'size_label'] = size_label[i]
-
-
-# process OS version
-OS_version_array = []
-OS_array = []
-for i in range(sessions_df.__len__()):
-    OS_version = sessions_df['backendPlatformInfo.version'].iloc[i]
-
-    if sessions_df['backendPlatform'].iloc[i] == 'macOS':
-        OS_version_array.append(OS_version.split('.')[0])
-        OS_array.append(sessions_df['backendPlatform'].iloc[i])
+# collection -> (exported CSV, raw timestamp column in ms)
+COLLECTIONS = {
+    'entries': ('entries.csv', 'timestamp'),
+    'sessions': ('sessions.csv', 'startTime'),
+    'files': ('file_details.csv', 'timestamp'),
+    'spectral': ('spectralProfileGeneration.csv', 'timestamp'),
+}
+
+# string columns read as such even when one day of rows happens to look numeric
+CSV_DTYPES = {
+    'entries': {'sessionId': str, 'ipHash': str},
+    'sessions': {'id': str, 'userId': str, 'version': str,
+                 'backendPlatformInfo.distro': str, 'backendPlatformInfo.version': str},
+}
+
+HIGH_WATER_MARKS_FILE = 'high_water_marks.json'
+
+# rows of an export processed at a time; bounds the memory of the per-row stages
+DEFAULT_CHUNK_SIZE = 500_000
+
+# days with too few distinct IPs are flagged as missing data in the Users tab;
+# thresholds per year in a CSV, holidays as MM-DD (both settable in config)
+DEFAULT_MISSING_DATA_THRESHOLDS = 'missing_data_thresholds.csv'
+DEFAULT_HOLIDAYS = ['12-24', '12-25', '12-26', '12-27', '12-28', '12-29', '12-30', '12-31',
+                    '01-01', '01-02', '01-03', '01-04', '01-05']
+
+# first word of backendPlatformInfo.distro -> OS name shown in the dashboard
+OS_NAMES = {
+    'Debian': 'Debian GNU',
+    'Red': 'Red Hat',
+    'RHEL': 'Red Hat',
+    'Trisquel': 'Trisquel GNU',
+    'Linux': 'Linux Mint',
+}
+
+
+#### exported collections ####
+
+def read_export(dumped_file_dir, csv_file, chunk_size, dtype=None, columns=None):
+    """Iterate over an exported collection in chunks of at most *chunk_size* rows.
+
+    The Parquet file written by mongo_archive.py is read instead of the CSV
+    when it is the newer one. *columns* restricts the columns read.
+    """
+    csv_path = f"{dumped_file_dir}/{csv_file}"
+    parquet_path = f"{os.path.splitext(csv_path)[0]}.parquet"
+    if os.path.exists(parquet_path) and (
+            not os.path.exists(csv_path) or os.path.getmtime(parquet_path) >= os.path.getmtime(csv_path)):
+        for batch in pq.ParquetFile(parquet_path).iter_batches(batch_size=chunk_size, columns=columns):
+            df = batch.to_pandas()
+            for column in (dtype or {}).keys() & set(df.columns):
+                df[column] = df[column].where(df[column].isna(), df[column].astype(str))
+            yield df
     else:
-        OS_version_array.append(OS_version)
-        OS = str(sessions_df['backendPlatformInfo.distro'].iloc[i])
-        OS_array.append(OS.split(' ')[0])
-
-OS_array = np.array(OS_array)
-r = np.where(OS_array == 'Debian')[0]
-OS_array[r] = 'Debian GNU'
-r = np.where((OS_array == 'Red') | (OS_array == 'RHEL'))[0]
-OS_array[r] = 'Red Hat'
-r = np.where(OS_array == 'Trisquel')[0]
-OS_array[r] = 'Trisquel GNU'
-r = np.where(OS_array == 'Linux')[0]
-OS_array[r] = 'Linux Mint'
-
-sessions_df['OS_version'] = OS_version_array
-sessions_df['OS'] = OS_array
-
-sessions_df.drop(columns=['backendPlatformInfo.version', 'backendPlatformInfo.distro', 'backendPlatformInfo.variant'], inplace=True)
-
-
-# process country information
-users_df['country'] = users_df[~users_df.countryCode.isnull()].countryCode.apply(lambda x: country_alpha2_to_country_name(x))
-users_df.loc[users_df.countryCode == 'TW' ,'country'] = 'Taiwan'
-# users_df.drop(columns=['countryCode'], inplace=True)
-
-temp = entries_df[['sessionId', 'countryCode']].drop_duplicates(subset=['sessionId'])
-sessions_df = sessions_df.merge(temp, left_on='id', right_on='sessionId', how='left')
-sessions_df['country'] = sessions_df[~sessions_df.countryCode.isnull()].countryCode.apply(lambda x: country_alpha2_to_country_name(x))
-sessions_df.loc[sessions_df.countryCode == 'TW' ,'country'] = 'Taiwan'
-# sessions_df.drop(columns=['countryCode'], inplace=True)
-
-
-## to find the missing data dates 
-def extract_missing_data_dates():
-
-    selected_index = (entries_df['datetime'] > init_date.strftime('%Y-%m-%d')) & (entries_df['datetime'] <= today.strftime('%Y-%m-%d'))
-    resample_dates = entries_df[selected_index].resample('d', on='datetime')
-    date_counts = resample_dates.apply(lambda x: x.ipHash.unique().size)
-
-    ## modify here ##
-    xmas_newyear_holidays = ['12-24', '12-25', '12-26', '12-27', '12-28', '12-29', '12-30', '12-31', '01-01', '01-02', '01-03', '01-04', '01-05']
-    unusual_threshold = {'2021': {'workday': 0, 'holiday': 0}, 
-                        '2022': {'workday': 0, 'holiday': 0}, 
-                        '2023': {'workday': 60, 'holiday': 20}, 
-                        '2024': {'workday': 80, 'holiday': 30}, 
-                        '2025': {'workday': 100, 'holiday': 40}}
-    # if year is not listed, use the last year threshold
-    for year in range(2026, today.year + 1):
-        unusual_threshold[f'{year}'] = unusual_threshold[f'{year-1}']
-    ## modify here ##
-
-    missing_data = []
-    for i in range((today - init_date).days):
-        current_date = init_date + timedelta(days=i)
-        formatted_date = f"{current_date.year}-{current_date.month:02d}-{current_date.day:02d}"
-
-        if not formatted_date in date_counts.keys():
+        with pd.read_csv(csv_path, dtype=dtype, usecols=columns, chunksize=chunk_size) as reader:
+            yield from reader
+
+
+#### high-water marks ####
+
+def load_high_water_marks(processed_file_dir):
+    path = f"{processed_file_dir}/{HIGH_WATER_MARKS_FILE}"
+    if not os.path.exists(path):
+        return {}
+    with open(path) as f:
+        return json.load(f)
+
+
+def save_high_water_marks(processed_file_dir, marks):
+    path = f"{processed_file_dir}/{HIGH_WATER_MARKS_FILE}"
+    with open(f"{path}.tmp", 'w') as f:
+        json.dump(marks, f, indent=1)
+    os.replace(f"{path}.tmp", path)
+
+
+#### per-row processing (works on any batch of rows) ####
+
+def process_files(files_df):
+    files_df['datetime'] = pd.to_datetime(files_df.timestamp, unit='ms')
+    files_df.drop(columns=['timestamp'], inplace=True)
+
+    # process file type
+    r_width = files_df['details.width'] > 1
+    r_height = files_df['details.height'] > 1
+    r_depth = files_df['details.depth'] > 1
+    r_stokes = files_df['details.stokes'] > 1
+
+    stokes_4d = r_width & r_height & r_depth & r_stokes
+    stokes_3d = r_width & r_height & r_stokes & ~stokes_4d
+    three_dim = r_width & r_height & r_depth & ~stokes_4d  & ~stokes_3d
+    two_dim = r_width & r_height & ~stokes_4d  & ~stokes_3d & ~three_dim
+
+    files_df.loc[two_dim ,'file_type'] = '2D'
+    files_df.loc[three_dim ,'file_type'] = '3D'
+    files_df.loc[stokes_3d ,'file_type'] = '2D+Stokes'
+    files_df.loc[stokes_4d ,'file_type'] = '3D+Stokes'
+
+    files_df['fileSize'] = files_df['details.width'] * files_df['details.height'] * files_df['details.depth'] * files_df['details.stokes'] * 4 / 1024**2 # in MB
+
+    size_range = [0, 1, 10, 100, 1024, 10240, 102400, 1024**2, 1024**2*10] # in MB
+    size_label = ["<1MB", "1MB-10MB", "10MB-100MB", "100MB-1GB", "1GB-10GB", "10GB-100GB", "100GB-1TB", "1TB-10TB"] # in MB
+
+    for i in range(len(size_range)-1):
+        r = (files_df['fileSize'] > size_range[i]) & (files_df['fileSize'] <= size_range[i+1])
+        files_df.loc[r, 'size_label'] = size_label[i]
+    return files_df
+
+
+def process_sessions(sessions_df, entries_df):
+    sessions_df['datetime'] = pd.to_datetime(sessions_df.startTime, unit='ms')
+    sessions_df.drop(columns=['startTime'], inplace=True)
+
+    # process OS version: major version on macOS, first word of the distro elsewhere
+    platform = sessions_df['backendPlatform']
+    version = sessions_df['backendPlatformInfo.version'].astype(object)  # float when all missing
+    is_macos = platform == 'macOS'
+    distro = sessions_df['backendPlatformInfo.distro'].astype(str).str.split(' ', n=1).str[0]
+
+    sessions_df['OS_version'] = version.where(~is_macos, version.str.split('.', n=1).str[0])
+    sessions_df['OS'] = distro.where(~is_macos, platform).replace(OS_NAMES)
+    sessions_df.loc[sessions_df['OS'] == 'nan', 'OS'] = np.nan  # no distro reported
+
+    sessions_df.drop(columns=['backendPlatformInfo.version', 'backendPlatformInfo.distro', 'backendPlatformInfo.variant'], inplace=True)
+
+    # process country information, taken from the first entry of each session
+    temp = entries_df[['sessionId', 'countryCode']].drop_duplicates(subset=['sessionId'])
+    sessions_df = sessions_df.merge(temp, left_on='id', right_on='sessionId', how='left')
+    sessions_df = add_country_columns(sessions_df)
+    # sessions_df.drop(columns=['countryCode'], inplace=True)
+    return sessions_df
+
+
+def process_users(users_df):
+    users_df['datetime'] = pd.to_datetime(users_df.date, format='mixed')
+    users_df.drop(columns=['date'], inplace=True)
+
+    # process country information
+    # alpha-3 codes for the country map
+    users_df = add_country_columns(users_df, alpha3=True)
+    # users_df.drop(columns=['countryCode'], inplace=True)
+    return users_df
+
+
+def process_timestamps(df):
+    df['datetime'] = pd.to_datetime(df.timestamp, unit='ms')
+    df.drop(columns=['timestamp'], inplace=True)
+    return df
+
+
+#### derived tables ####
+
+def load_missing_data_thresholds(path):
+    """Minimum distinct IPs per day, by year, below which a day counts as missing data.
+
+    The CSV has `year`, `workday` and `holiday` columns; a year that is not
+    listed uses the thresholds of the closest listed year before it.
+    """
+    return pd.read_csv(path, index_col='year').sort_index()
+
+
+## to find the missing data dates
+def extract_missing_data_dates(entries_df, first_date, today, thresholds, holidays=DEFAULT_HOLIDAYS,
+                               inclusive=False):
+    """Days from *first_date* up to, not including, *today* with fewer distinct IPs than their threshold.
+
+    Weekends and the month-days in *holidays* ('MM-DD') use the `holiday`
+    threshold of *thresholds*, other days the `workday` one. Days before the
+    first or after the last selected entry are not reported. Entries at
+    exactly *first_date* only count with *inclusive*, as an incremental run
+    needs to agree with a full one.
+    """
+    first_date, today = pd.Timestamp(first_date), pd.Timestamp(today)
+    after_first = entries_df['datetime'] >= first_date if inclusive else entries_df['datetime'] > first_date
+    selected = after_first & (entries_df['datetime'] <= today)
+    rows = pd.DataFrame({
+        'day': entries_df['datetime'][selected].dt.floor('D'),
+        'ipHash': entries_df['ipHash'][selected],
+    })
+
+    # distinct IPs per day, a missing ipHash counting as one more
+    date_counts = rows.drop_duplicates().groupby('day').size()
+    if date_counts.empty:
+        return pd.DataFrame({'datetime': pd.DatetimeIndex([], dtype='datetime64[ns]')})
+    days = pd.date_range(date_counts.index.min(), date_counts.index.max(), freq='D')
+    date_counts = date_counts.reindex(days, fill_value=0)
+    date_counts = date_counts[(days >= first_date) & (days < today)]
+    days = date_counts.index
+
+    years = range(min(thresholds.index.min(), days.year.min()), max(thresholds.index.max(), days.year.max()) + 1)
+    thresholds = thresholds.reindex(years).ffill().bfill().loc[days.year]
+    is_holiday = days.strftime('%m-%d').isin(holidays) | (days.weekday >= 5)
+    threshold = np.where(is_holiday, thresholds['holiday'], thresholds['workday'])
+
+    return pd.DataFrame({'datetime': days[date_counts.to_numpy() < threshold]})
+
+
+#### stages ####
+# Every stage is a function of the run context `ctx` and of the results of
+# the stages it depends on (keyword arguments named after them). Stages
+# exchange only small results; tables go through the processed data dir.
+
+def ingest(ctx, name, process):
+    """Stream the rows of one export above its high-water mark through *process* into its partitions."""
+    csv_file, timestamp_column = COLLECTIONS[name]
+    processed_file_dir = ctx['processed_file_dir']
+    previous_mark = ctx['previous_marks'].get(name)
+
+    # rows above the old mark left behind by an interrupted run are dropped first
+    if not ctx['incremental']:
+        clear_partitions(processed_file_dir, name)
+    elif previous_mark is not None:
+        truncate_partitions(processed_file_dir, name, pd.to_datetime(previous_mark, unit='ms'))
+
+    result = {'mark': previous_mark, 'count': 0, 'first_new': None}
+    for df in read_export(ctx['dumped_file_dir'], csv_file, ctx['chunk_size'], dtype=CSV_DTYPES.get(name)):
+        if previous_mark is not None:
+            df = df[df[timestamp_column] > previous_mark].reset_index(drop=True)
+        if not len(df):
             continue
+        result['mark'] = max(result['mark'] or 0, int(df[timestamp_column].max()))
+        result['count'] += len(df)
+
+        df = process(df)
+        first_new = df['datetime'].min()
+        if result['first_new'] is None or first_new < result['first_new']:
+            result['first_new'] = first_new
+        append_partitions(df, processed_file_dir, name)
+    return result
+
 
-        if (f"{current_date.month:02d}-{current_date.day:02d}" in xmas_newyear_holidays) | (current_date.weekday() in [5, 6]):
-            if date_counts[formatted_date] < unusual_threshold[f'{current_date.year}']['holiday']:
-                missing_data.append(formatted_date)
-        else:
-            if date_counts[formatted_date] < unusual_threshold[f'{current_date.year}']['workday']:
-                missing_data.append(formatted_date)
+def collect_session_countries(ctx):
+    """(sessionId, countryCode) of the first new entry of each session.
 
-    return pd.DataFrame(pd.to_datetime(missing_data, format='%Y-%m-%d'), columns=['datetime'])
+    Reads only these columns of the entries export, so the sessions do not
+    wait for the entries to be processed.
+    """
+    csv_file, timestamp_column = COLLECTIONS['entries']
+    previous_mark = ctx['previous_marks'].get('entries')
+    first_entries = [pd.DataFrame(columns=['sessionId', 'countryCode'])]
+    for df in read_export(ctx['dumped_file_dir'], csv_file, ctx['chunk_size'], dtype=CSV_DTYPES['entries'],
+                          columns=[timestamp_column, 'sessionId', 'countryCode']):
+        if previous_mark is not None:
+            df = df[df[timestamp_column] > previous_mark]
+        first_entries.append(df[['sessionId', 'countryCode']].drop_duplicates(subset=['sessionId']))
+    return pd.concat(first_entries, ignore_index=True).drop_duplicates(subset=['sessionId'])
 
 
-missing_data_dates = extract_missing_data_dates()
-missing_data_dates['datetime'] = pd.to_datetime(missing_data_dates.datetime)
+def ingest_entries(ctx):
+    return ingest(ctx, 'entries', process_timestamps)
 
 
-# save processed data
-processed_file_dir = configParser.get('PATH', 'df_dir')
+def ingest_sessions(ctx, session_countries):
+    return ingest(ctx, 'sessions', lambda df: process_sessions(df, session_countries))
 
-missing_data_dates.to_csv(f"{processed_file_dir}/missing_data_dates.csv", index=False)
-files_df.to_csv(f"{processed_file_dir}/processed_files.csv", index=False)
-spectral_df.to_csv(f"{processed_file_dir}/processed_spectral.csv", index=False)
-users_df.to_csv(f"{processed_file_dir}/processed_users.csv", index=False)
-sessions_df.to_csv(f"{processed_file_dir}/processed_sessions.csv", index=False)
-entries_df.to_csv(f"{processed_file_dir}/processed_entries.csv", index=False)
\ No newline at end of file
+
+def ingest_files(ctx):
+    return ingest(ctx, 'files', process_files)
+
+
+def ingest_spectral(ctx):
+    return ingest(ctx, 'spectral', process_timestamps)
+
+
+def publish(ctx, name):
+    """Write the served table of a collection: every partition, sorted by time
+    so the dashboard can slice date ranges with a binary search."""
+    processed_file_dir = ctx['processed_file_dir']
+    write_table(read_partitions(processed_file_dir, name), processed_file_dir, f'processed_{name}')
+
+
+def publish_entries(ctx, entries):
+    publish(ctx, 'entries')
+
+
+def publish_sessions(ctx, sessions):
+    publish(ctx, 'sessions')
+
+
+def publish_files(ctx, files):
+    publish(ctx, 'files')
+
+
+def publish_spectral(ctx, spectral):
+    publish(ctx, 'spectral')
+
+
+def publish_users(ctx):
+    # users are a small table re-dated by add_date_for_users.py; always rebuilt
+    users_df = process_users(pd.read_csv(f"{ctx['dumped_file_dir']}/users_with_date.csv"))
+    users_df = users_df.sort_values('datetime', kind='stable', ignore_index=True)
+    write_table(users_df, ctx['processed_file_dir'], 'processed_users')
+
+
+def first_affected_day(ctx, *ingested):
+    """First day whose derived rows change; None when everything is rebuilt."""
+    first_new = [result['first_new'] for result in ingested if result['first_new'] is not None]
+    if not ctx['incremental'] or not first_new:
+        return None
+    return min(first_new).floor('D')
+
+
+def build_missing_data_dates(ctx, entries, sessions, files, processed_entries):
+    processed_file_dir = ctx['processed_file_dir']
+    first_day = first_affected_day(ctx, entries, sessions, files)
+    entries_df = read_table(processed_file_dir, 'processed_entries')
+    if first_day is None:
+        missing_data_dates = extract_missing_data_dates(
+            entries_df, init_date, ctx['today'], ctx['missing_data_thresholds'], ctx['holidays'])
+    else:
+        # recompute the affected days only
+        missing_data_dates = read_table(processed_file_dir, 'missing_data_dates')
+        missing_data_dates = pd.concat(
+            [missing_data_dates[missing_data_dates['datetime'] < first_day],
+             extract_missing_data_dates(entries_df, first_day, ctx['today'],
+                                        ctx['missing_data_thresholds'], ctx['holidays'], inclusive=True)],
+            ignore_index=True,
+        )
+    write_table(missing_data_dates, processed_file_dir, 'missing_data_dates')
+
+
+def build_cube(ctx, entries, sessions, files, processed_entries, processed_sessions, processed_files, processed_users):
+    processed_file_dir = ctx['processed_file_dir']
+    first_day = first_affected_day(ctx, entries, sessions, files)
+    # the compact, memory-mapped served tables
+    tables = {name: read_table(processed_file_dir, f'processed_{name}') for name in ('entries', 'sessions', 'files', 'users')}
+    if first_day is None:
+        daily_cube = build_daily_cube(tables)
+    else:
+        # recompute the affected days only; the country dimension counts
+        # users, which are always rebuilt
+        daily_cube = read_table(processed_file_dir, 'daily_cube')
+        kept = (daily_cube['date'] < first_day) & (daily_cube['dimension'] != 'country')
+        row_dimensions = {d: c for d, c in CUBE_DIMENSIONS.items() if d != 'country'}
+        recent = {name: date_slice(df, first_day, df['datetime'].max()) for name, df in tables.items()}
+        daily_cube = pd.concat(
+            [daily_cube[kept].astype({c: object for c in ('countryCode', 'dimension', 'value')}),
+             build_daily_cube(recent, row_dimensions),
+             build_daily_cube(tables, {'country': CUBE_DIMENSIONS['country']})],
+            ignore_index=True,
+        ).sort_values('date', kind='stable', ignore_index=True)
+    write_table(daily_cube, processed_file_dir, 'daily_cube')
+
+
+def refresh_daily_table(ctx, name, build, df, first_day, labels):
+    """Write daily table *name* built from *df*, or only its days from *first_day* on."""
+    processed_file_dir = ctx['processed_file_dir']
+    if first_day is None:
+        table = build(df)
+    else:
+        # recompute the affected days only
+        table = read_table(processed_file_dir, name)
+        table = pd.concat(
+            [table[table['date'] < first_day].astype({c: object for c in labels}),
+             build(date_slice(df, first_day, df['datetime'].max()))],
+            ignore_index=True,
+        )
+    write_table(table, processed_file_dir, name)
+
+
+def build_os_versions(ctx, sessions, processed_sessions):
+    sessions_df = read_table(ctx['processed_file_dir'], 'processed_sessions')
+    refresh_daily_table(ctx, 'daily_os_versions', build_daily_os_versions, sessions_df,
+                        first_affected_day(ctx, sessions), ('countryCode', 'backendPlatform', 'OS', 'OS_version'))
+
+
+def build_file_rollups(ctx, files, processed_files):
+    files_df = read_table(ctx['processed_file_dir'], 'processed_files')
+    first_day = first_affected_day(ctx, files)
+    refresh_daily_table(ctx, 'daily_file_sizes', build_daily_file_sizes, files_df, first_day,
+                        ('countryCode', 'file_type', 'size_label'))
+    refresh_daily_table(ctx, 'daily_file_shapes', build_daily_file_shapes, files_df, first_day,
+                        ('countryCode', 'histogram'))
+
+
+def build_first_seen(ctx, processed_entries, processed_users):
+    processed_file_dir = ctx['processed_file_dir']
+    # first appearances depend on the whole history, and codes change between runs
+    entries_df = read_table(processed_file_dir, 'processed_entries')
+    users_df = read_table(processed_file_dir, 'processed_users')
+    write_table(build_daily_first_seen(entries_df, users_df), processed_file_dir, 'daily_first_seen')
+
+
+def build_sketches(ctx, entries, sessions, files):
+    processed_file_dir = ctx['processed_file_dir']
+    first_day = first_affected_day(ctx, entries, sessions, files)
+    # sketches hash the original strings, whose codes may change between runs
+    sketch_rows = read_partitions(processed_file_dir, 'entries', columns=['datetime', *SKETCH_COLUMNS], since=first_day)
+    save_sketches(f"{processed_file_dir}/hll_sketches.npz", sketch_rows, since=first_day)
+
+
+# stage -> (function, stages it depends on)
+STAGES = {
+    'entries': (ingest_entries, []),
+    'session_countries': (collect_session_countries, []),
+    'sessions': (ingest_sessions, ['session_countries']),
+    'files': (ingest_files, []),
+    'spectral': (ingest_spectral, []),
+    'processed_entries': (publish_entries, ['entries']),
+    'processed_sessions': (publish_sessions, ['sessions']),
+    'processed_files': (publish_files, ['files']),
+    'processed_spectral': (publish_spectral, ['spectral']),
+    'processed_users': (publish_users, []),
+    'missing_data_dates': (build_missing_data_dates, ['entries', 'sessions', 'files', 'processed_entries']),
+    'daily_cube': (build_cube, ['entries', 'sessions', 'files', 'processed_entries',
+                                'processed_sessions', 'processed_files', 'processed_users']),
+    'daily_os_versions': (build_os_versions, ['sessions', 'processed_sessions']),
+    'file_rollups': (build_file_rollups, ['files', 'processed_files']),
+    'daily_first_seen': (build_first_seen, ['processed_entries', 'processed_users']),
+    'hll_sketches': (build_sketches, ['entries', 'sessions', 'files']),
+}
+
+
+def critical_path(stages, timings):
+    """Seconds of the longest chain of dependent stages: the wall-clock with enough cores."""
+    finish = {}
+    for name, (_, dependencies) in stages.items():  # dependencies come first in STAGES
+        finish[name] = timings[name] + max((finish[d] for d in dependencies), default=0)
+    return max(finish.values())
+
+
+def _timed(function, ctx, **dependencies):
+    start = time.perf_counter()
+    result = function(ctx, **dependencies)
+    return result, time.perf_counter() - start
+
+
+def run_stages(stages, ctx, workers):
+    """Run every stage once its dependencies are done, up to *workers* at a time.
+
+    Returns stage -> result and stage -> seconds. With one worker the stages
+    run in the order of *stages*, in this process.
+    """
+    results, timings = {}, {}
+    if workers == 1:
+        for name, (function, dependencies) in stages.items():
+            results[name], timings[name] = _timed(function, ctx, **{d: results[d] for d in dependencies})
+        return results, timings
+
+    pending = dict(stages)
+    running = {}
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        while pending or running:
+            for name, (function, dependencies) in list(pending.items()):
+                if all(d in results for d in dependencies):
+                    future = pool.submit(_timed, function, ctx, **{d: results[d] for d in dependencies})
+                    running[future] = name
+                    del pending[name]
+            done, _ = wait(running, return_when=FIRST_COMPLETED)
+            for future in done:
+                name = running.pop(future)
+                results[name], timings[name] = future.result()
+    return results, timings
+
+
+#### main ####
+
+def preprocess(incremental=False, chunk_size=None, workers=None):
+    configParser = configparser.ConfigParser()
+    configParser.read('config')
+    processed_file_dir = configParser.get('PATH', 'df_dir')
+    if chunk_size is None:
+        chunk_size = configParser.getint('PREPROCESS', 'chunk_size', fallback=DEFAULT_CHUNK_SIZE)
+    if workers is None:
+        workers = configParser.getint('PREPROCESS', 'workers', fallback=os.cpu_count())
+    os.makedirs(processed_file_dir, exist_ok=True)
+
+    previous_marks = load_high_water_marks(processed_file_dir) if incremental else {}
+    ctx = {
+        'dumped_file_dir': configParser.get('PATH', 'dumped_file_dir'),
+        'processed_file_dir': processed_file_dir,
+        'chunk_size': chunk_size,
+        'today': datetime.today().date(),
+        # 'today': date(2025, 2, 28),
+        'missing_data_thresholds': load_missing_data_thresholds(
+            configParser.get('PREPROCESS', 'missing_data_thresholds', fallback=DEFAULT_MISSING_DATA_THRESHOLDS)),
+        'holidays': [day.strip() for day in configParser.get(
+            'PREPROCESS', 'holidays', fallback=','.join(DEFAULT_HOLIDAYS)).split(',')],
+        'previous_marks': previous_marks,
+        'incremental': bool(previous_marks),  # nothing processed yet: full rebuild
+    }
+
+    start = time.perf_counter()
+    results, timings = run_stages(STAGES, ctx, workers)
+    print(', '.join(f"{results[name]['count']} new {name}" for name in COLLECTIONS))
+    for name, seconds in sorted(timings.items(), key=lambda item: -item[1]):
+        print(f"  {name:20s} {seconds:7.2f}s")
+    print(f"  {'total':20s} {time.perf_counter() - start:7.2f}s with {workers} worker(s), "
+          f"critical path {critical_path(STAGES, timings):.2f}s")
+
+    # only advance the marks once everything derived from the new rows is written
+    marks = {name: results[name]['mark'] for name in COLLECTIONS if results[name]['mark'] is not None}
+    save_high_water_marks(processed_file_dir, marks)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--incremental', action='store_true',
+                        help='only process rows newer than the stored high-water marks')
+    parser.add_argument('--chunk-size', type=int,
+                        help=f'rows processed at a time (default: chunk_size in the [PREPROCESS] section of config, or {DEFAULT_CHUNK_SIZE})')
+    parser.add_argument('--workers', type=int,
+                        help='stages run at the same time (default: workers in the [PREPROCESS] section of config, or one per core)')
+    args = parser.parse_args()
+    preprocess(incremental=args.incremental, chunk_size=args.chunk_size, workers=args.workers)
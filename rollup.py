@@ -0,0 +1,314 @@
+"""
+rollup.py — Pre-aggregated daily count tables for the CARTA telemetry dashboard.
+
+`preprocess_df.py` builds the tables from the processed DataFrames once per
+night; `data.py` loads them and the figure callbacks sum a date slice of a
+small table instead of re-scanning millions of raw rows on every request.
+"""
+
+import numpy as np
+import pandas as pd
+
+from helpers import select_rows
+from schema import has_value
+
+# ---------------------------------------------------------------------------
+# Daily cube: (date, countryCode, dimension, value) -> count
+# ---------------------------------------------------------------------------
+
+# dimension name -> (source table, column counted per value)
+CUBE_DIMENSIONS = {
+    "action": ("entries", "action"),
+    "version": ("sessions", "version"),
+    "backendPlatform": ("sessions", "backendPlatform"),
+    "OS": ("sessions", "OS"),
+    "country": ("users", "country"),
+}
+
+CUBE_COLUMNS = ["date", "countryCode", "dimension", "value", "count"]
+
+
+def build_daily_cube(tables: dict, dimensions: dict = CUBE_DIMENSIONS) -> pd.DataFrame:
+    """Count rows per (day, countryCode, value) for every entry of *dimensions*.
+
+    *tables* maps the source names used in *dimensions* ("entries",
+    "sessions", "files", "users") to processed DataFrames with `datetime`
+    and `countryCode` columns. Rows without a value are skipped; rows without
+    a country code are kept so the "All" selection still counts them.
+    """
+    parts = []
+    for dimension, (table, column) in dimensions.items():
+        df = tables[table]
+        counts = (
+            df.groupby(
+                [
+                    df["datetime"].dt.floor("D").rename("date"),
+                    df["countryCode"],
+                    df[column].rename("value"),
+                ],
+                dropna=False,
+                observed=True,
+            )
+            .size()
+            .rename("count")
+            .reset_index()
+        )
+        counts = counts[counts["value"].notna()]
+        counts["value"] = counts["value"].astype(str)
+        counts.insert(2, "dimension", dimension)
+        parts.append(counts)
+
+    cube = pd.concat(parts, ignore_index=True)[CUBE_COLUMNS]
+    return cube.sort_values("date", kind="stable").reset_index(drop=True)
+
+
+def select_days(table, country_index: dict, start_date, end_date, country_value: str = ""):
+    """Rows of a daily table for the country filter over a date range.
+
+    Both ends of the range are whole days: a row dated on *end_date* is
+    included. An empty *country_value* selects every country. *table* must
+    be sorted by date, as the build_daily_*() functions return it, and
+    *country_index* built from it with `helpers.build_country_index()`.
+    """
+    start_day = pd.Timestamp(start_date).floor("D")
+    end_day = pd.Timestamp(end_date).floor("D")
+    return select_rows(table, country_index, country_value, start_day, end_day, column="date")
+
+
+def cube_counts(
+    cube, country_index: dict, dimension: str, start_date, end_date, country_value: str = ""
+) -> pd.Series:
+    """Sum the cube for *dimension* over a date range, largest count first.
+
+    Rows are selected with select_days().
+    """
+    cube = select_days(cube, country_index, start_date, end_date, country_value)
+    counts = cube[cube["dimension"] == dimension].groupby("value", observed=True)["count"].sum()
+    counts.index = counts.index.astype(object)  # plain labels, not the cube's categories
+    return counts[counts > 0].sort_values(ascending=False, kind="stable")
+
+
+# ---------------------------------------------------------------------------
+# Daily first-seen: (date, countryCode, dimension) -> count of new values
+# ---------------------------------------------------------------------------
+
+FIRST_SEEN_COLUMNS = ["date", "countryCode", "dimension", "count"]
+
+
+def _first_seen_per_day(dates, countries, values) -> pd.DataFrame:
+    """Count the values first seen on each day, overall and within each country.
+
+    Overall rows have an empty countryCode, the "All" selection; a value seen
+    in two countries is new once overall and once in each country.
+    """
+    rows = pd.DataFrame({"date": dates, "countryCode": countries, "value": values})
+    overall = rows.groupby("value")["date"].min().value_counts().rename("count").reset_index()
+    overall.insert(1, "countryCode", "")
+    first = rows.groupby(["countryCode", "value"], observed=True)["date"].min().reset_index()
+    per_country = first.groupby(["date", "countryCode"], observed=True).size().rename("count").reset_index()
+    per_country["countryCode"] = per_country["countryCode"].astype(str)
+    return pd.concat([overall, per_country], ignore_index=True)
+
+
+def build_daily_first_seen(entries, users) -> pd.DataFrame:
+    """Count the IPs (`ipHash`) and users (`uuid`) seen for the first time per day.
+
+    IPs are dated by their first entry. Users are already dated by the first
+    snapshot they appear in, one row each, so every row counts.
+    """
+    entries = entries[has_value(entries["ipHash"])]
+    ip = _first_seen_per_day(
+        entries["datetime"].dt.floor("D"), entries["countryCode"], entries["ipHash"]
+    )
+    ip.insert(2, "dimension", "ipHash")
+    uuid = _first_seen_per_day(users["datetime"].dt.floor("D"), users["countryCode"], users.index)
+    uuid.insert(2, "dimension", "uuid")
+
+    table = pd.concat([ip, uuid], ignore_index=True)[FIRST_SEEN_COLUMNS]
+    return table.sort_values("date", kind="stable").reset_index(drop=True)
+
+
+def first_seen_series(table, dimension: str, period: str, country_value: str = "", window=None) -> tuple:
+    """New values per resample bucket and their running total, from build_daily_first_seen().
+
+    With a *window* from `helpers.period_window`, only its buckets; the
+    running total then starts from the sum of the days before it.
+    """
+    selected = table[(table["dimension"] == dimension) & (table["countryCode"] == country_value)]
+    daily = pd.Series(selected["count"].to_numpy(), index=pd.DatetimeIndex(selected["date"]))
+    offset = 0
+    if window is not None:
+        start, stop = window
+        offset = int(daily[daily.index < start].sum())
+        daily = daily[(daily.index >= start) & (daily.index < stop)]
+    counts = daily.resample(period).sum()
+    return counts, offset + counts.cumsum()
+
+
+# ---------------------------------------------------------------------------
+# Daily OS versions: (date, countryCode, backendPlatform, OS, OS_version) -> count
+# ---------------------------------------------------------------------------
+
+OS_VERSION_COLUMNS = ["date", "countryCode", "backendPlatform", "OS", "OS_version", "count"]
+OS_VERSION_LEVELS = ["backendPlatform", "OS", "OS_version"]
+
+
+def build_daily_os_versions(sessions) -> pd.DataFrame:
+    """Count the sessions of a known CARTA version per (day, countryCode, platform, OS, OS version).
+
+    Sessions without an OS are left out; those without an OS version are
+    kept with a missing one, as they still count towards their OS.
+    """
+    sessions = sessions[sessions["version"].notna() & sessions["OS"].notna()]
+    counts = (
+        sessions.groupby(
+            [sessions["datetime"].dt.floor("D").rename("date"), "countryCode", *OS_VERSION_LEVELS],
+            dropna=False,
+            observed=True,
+        )
+        .size()
+        .rename("count")
+        .reset_index()
+    )
+    return counts[OS_VERSION_COLUMNS].sort_values("date", kind="stable").reset_index(drop=True)
+
+
+def os_version_counts(table, country_index: dict, start_date, end_date, country_value: str = "") -> pd.Series:
+    """Sum build_daily_os_versions() over a date range per (backendPlatform, OS, OS_version).
+
+    Missing OS versions stay a NaN level value. Both ends of the range are
+    whole days, as in select_days().
+    """
+    table = select_days(table, country_index, start_date, end_date, country_value)
+    counts = table.groupby(OS_VERSION_LEVELS, dropna=False, observed=True)["count"].sum()
+    return counts[counts > 0]
+
+
+# ---------------------------------------------------------------------------
+# Daily file sizes: (date, countryCode, file_type, size_label) -> count
+# ---------------------------------------------------------------------------
+
+FILE_SIZE_COLUMNS = ["date", "countryCode", "file_type", "size_label", "count"]
+
+
+def build_daily_file_sizes(files) -> pd.DataFrame:
+    """Count the files opened per (day, countryCode, file_type, size_label).
+
+    Files missing a type or a size label are kept, so each label is still
+    counted in full on its own.
+    """
+    counts = (
+        files.groupby(
+            [files["datetime"].dt.floor("D").rename("date"), "countryCode", "file_type", "size_label"],
+            dropna=False,
+            observed=True,
+        )
+        .size()
+        .rename("count")
+        .reset_index()
+    )
+    counts = counts[counts["file_type"].notna() | counts["size_label"].notna()][FILE_SIZE_COLUMNS]
+    return counts.sort_values("date", kind="stable").reset_index(drop=True)
+
+
+def file_size_crosstab(
+    table, country_index: dict, start_date, end_date, country_value: str = ""
+) -> pd.DataFrame:
+    """Files per file type (rows) and size label (columns) over a date range.
+
+    One bincount over the category codes of a date slice of
+    build_daily_file_sizes(). Rows and columns follow the category order,
+    each followed by a NaN entry for the files missing that label. Both ends
+    of the range are whole days, as in select_days().
+    """
+    table = select_days(table, country_index, start_date, end_date, country_value)
+
+    file_types = table["file_type"].astype("category").cat
+    size_labels = table["size_label"].astype("category").cat
+    n_types = len(file_types.categories) + 1
+    n_labels = len(size_labels.categories) + 1
+    # a missing label (code -1) goes to the last row or column
+    rows = np.where(file_types.codes < 0, n_types - 1, file_types.codes)
+    columns = np.where(size_labels.codes < 0, n_labels - 1, size_labels.codes)
+    counts = np.bincount(
+        rows * n_labels + columns, weights=table["count"].to_numpy(), minlength=n_types * n_labels
+    )
+    return pd.DataFrame(
+        counts.reshape(n_types, n_labels).astype(np.int64),
+        index=pd.Index([*file_types.categories, np.nan], dtype=object, name="file_type"),
+        columns=pd.Index([*size_labels.categories, np.nan], dtype=object, name="size_label"),
+    )
+
+
+# ---------------------------------------------------------------------------
+# Daily file shapes: (date, countryCode, histogram, x_bin, y_bin) -> count
+# ---------------------------------------------------------------------------
+
+# histogram name -> (x column, y column) of the cubes opened
+SHAPE_HISTOGRAMS = {
+    "width_height": ("details.width", "details.height"),
+    "width_depth": ("details.width", "details.depth"),
+}
+SHAPE_FILE_TYPES = ["3D", "3D+Stokes"]
+SHAPE_BIN_SIZE = 0.2  # in log10(pixels)
+SHAPE_BINS = 25  # 0 to 5 in log10, i.e. 1 to 100000 pixels
+
+SHAPE_COLUMNS = ["date", "countryCode", "histogram", "x_bin", "y_bin", "count"]
+
+
+def shape_bins(pixels) -> np.ndarray:
+    """Log10 bin of each pixel count, -1 outside the grid.
+
+    Bins are left-closed like plotly's, with the same 1e-9 tolerance so
+    exact powers of ten land in the bin they start.
+    """
+    with np.errstate(divide="ignore", invalid="ignore"):
+        bins = np.floor(np.log10(np.asarray(pixels, dtype=np.float64)) / SHAPE_BIN_SIZE + 1e-9)
+    inside = (bins >= 0) & (bins < SHAPE_BINS)
+    return np.where(inside, bins, -1).astype(np.int8)
+
+
+def build_daily_file_shapes(files) -> pd.DataFrame:
+    """Count the 3D cubes opened per (day, countryCode) in each cell of SHAPE_HISTOGRAMS.
+
+    Cubes with a dimension outside the grid are left out of that histogram;
+    rows without a country code are kept so the "All" selection counts them.
+    """
+    files = files[files["file_type"].isin(SHAPE_FILE_TYPES)]
+    parts = []
+    for histogram, (x_column, y_column) in SHAPE_HISTOGRAMS.items():
+        cells = pd.DataFrame({
+            "date": files["datetime"].dt.floor("D").to_numpy(),
+            "countryCode": files["countryCode"].to_numpy(),
+            "x_bin": shape_bins(files[x_column]),
+            "y_bin": shape_bins(files[y_column]),
+        })
+        cells = cells[(cells["x_bin"] >= 0) & (cells["y_bin"] >= 0)]
+        counts = (
+            cells.groupby(["date", "countryCode", "x_bin", "y_bin"], dropna=False, observed=True)
+            .size()
+            .rename("count")
+            .reset_index()
+        )
+        counts.insert(2, "histogram", histogram)
+        parts.append(counts)
+
+    shapes = pd.concat(parts, ignore_index=True)[SHAPE_COLUMNS]
+    return shapes.sort_values("date", kind="stable").reset_index(drop=True)
+
+
+def file_shape_histograms(table, country_index: dict, start_date, end_date, country_value: str = "") -> dict:
+    """Sum the daily file shapes over a date range into one SHAPE_BINS x SHAPE_BINS matrix per histogram.
+
+    Matrices are indexed [y_bin, x_bin], as plotly heatmaps take them. Both
+    ends of the range are whole days, as in select_days().
+    """
+    table = select_days(table, country_index, start_date, end_date, country_value)
+
+    histograms = {}
+    for histogram in SHAPE_HISTOGRAMS:
+        cells = table[table["histogram"] == histogram]
+        matrix = np.zeros((SHAPE_BINS, SHAPE_BINS), dtype=np.int64)
+        np.add.at(matrix, (cells["y_bin"].to_numpy(), cells["x_bin"].to_numpy()), cells["count"].to_numpy())
+        histograms[histogram] = matrix
+    return histograms
@@ -0,0 +1,146 @@
+"""
+schema.py — Compact dtypes of the processed tables.
+
+Every column written by `preprocess_df.py` is declared here with the
+smallest dtype that holds it. `storage.write_table()` applies the schema
+before writing and `storage.read_table()` applies it after reading, so the
+dashboard always sees the same compact frames:
+
+- "category": low-cardinality labels; `==` filters and `value_counts` in
+  the callbacks run on the integer codes.
+- "code": hashes and ids that are only ever counted or deduplicated, stored
+  as int32 codes (MISSING_CODE for a missing value) instead of long strings.
+  Codes are assigned per column and per preprocessing run, so they are only
+  comparable within one column of one processed data set.
+- plain NumPy dtypes for numbers and timestamps, or the nullable
+  "Int64"/"Int32"/"boolean" ones for columns that can have missing values.
+"""
+
+import numpy as np
+import pandas as pd
+
+MISSING_CODE = -1
+
+# table name -> column -> dtype
+SCHEMA = {
+    "processed_users": {
+        "_id": "code",
+        "uuid": "code",
+        "countryCode": "category",
+        "optOut": "boolean",
+        "regionCode": "category",
+        "datetime": "datetime64[ns]",
+        "country": "category",
+        "countryAlpha3": "category",
+    },
+    "processed_sessions": {
+        "id": "code",
+        "userId": "code",
+        "version": "category",
+        "endTime": "Int64",
+        "duration": "Int64",
+        "backendPlatform": "category",
+        "datetime": "datetime64[ns]",
+        "OS_version": "category",
+        "OS": "category",
+        "sessionId": "code",
+        "countryCode": "category",
+        "country": "category",
+    },
+    "processed_entries": {
+        "sessionId": "code",
+        "action": "category",
+        "countryCode": "category",
+        "ipHash": "code",
+        "datetime": "datetime64[ns]",
+    },
+    "processed_files": {
+        "countryCode": "category",
+        "details.width": "float32",
+        "details.height": "float32",
+        "details.depth": "float32",
+        "details.stokes": "float32",
+        "datetime": "datetime64[ns]",
+        "file_type": "category",
+        "fileSize": "float32",
+        "size_label": "category",
+    },
+    "processed_spectral": {
+        "countryCode": "category",
+        "details.profileLength": "Int32",
+        "details.regionId": "Int32",
+        "details.width": "Int32",
+        "details.height": "Int32",
+        "details.depth": "Int32",
+        "datetime": "datetime64[ns]",
+    },
+    "missing_data_dates": {
+        "datetime": "datetime64[ns]",
+    },
+    "daily_cube": {
+        "date": "datetime64[ns]",
+        "countryCode": "category",
+        "dimension": "category",
+        "value": "category",
+        "count": "int64",
+    },
+    "daily_os_versions": {
+        "date": "datetime64[ns]",
+        "countryCode": "category",
+        "backendPlatform": "category",
+        "OS": "category",
+        "OS_version": "category",
+        "count": "int64",
+    },
+    "daily_file_sizes": {
+        "date": "datetime64[ns]",
+        "countryCode": "category",
+        "file_type": "category",
+        "size_label": "category",
+        "count": "int64",
+    },
+    "daily_file_shapes": {
+        "date": "datetime64[ns]",
+        "countryCode": "category",
+        "histogram": "category",
+        "x_bin": "int8",
+        "y_bin": "int8",
+        "count": "int64",
+    },
+    "daily_first_seen": {
+        "date": "datetime64[ns]",
+        "countryCode": "category",
+        "dimension": "category",
+        "count": "int64",
+    },
+}
+
+
+def apply_schema(df: pd.DataFrame, table: str) -> pd.DataFrame:
+    """Convert the columns of *df* declared for *table* to their compact dtype.
+
+    Columns that already have it are left untouched, so a memory-mapped
+    frame is not copied. Undeclared columns are kept as they are.
+    """
+    for column, dtype in SCHEMA.get(table, {}).items():
+        if column not in df.columns:
+            continue
+        values = df[column]
+        if dtype == "category":
+            if not isinstance(values.dtype, pd.CategoricalDtype):
+                # str categories with NaN kept as missing (mixed str/float columns from CSV)
+                df[column] = values.where(values.isna(), values.astype(str)).astype("category")
+        elif dtype == "code":
+            if values.dtype != np.int32:
+                df[column] = pd.factorize(values, use_na_sentinel=True)[0].astype(np.int32)
+        elif dtype == "datetime64[ns]":
+            if values.dtype != dtype:
+                df[column] = pd.to_datetime(values, format="mixed")
+        elif values.dtype != dtype:
+            df[column] = values.astype(dtype)
+    return df
+
+
+def has_value(values: pd.Series) -> pd.Series:
+    """Boolean mask of the non-missing entries of a column, code columns included."""
+    return values.notna() & (values != MISSING_CODE)
@@ -0,0 +1,237 @@
+"""
+storage.py — Reading and writing the processed data layer.
+
+`preprocess_df.py` writes every processed table as typed, compressed Parquet
+with native timestamp and dictionary-encoded (categorical) columns, so
+`data.py` loads it without re-parsing dates or building object-dtype
+strings; the column dtypes are declared in `schema.py`. Tables still stored
+as CSV by an older preprocessing run are read from the CSV instead.
+
+Next to the Parquet file each table is also written as a column store — one
+uncompressed .npy file per column under `{df_dir}/columns/{name}/` — which
+`data.py` memory-maps read-only. Every gunicorn worker then shares the same
+page-cache copy of the data instead of holding a private one.
+
+The processed rows themselves are kept in monthly Parquet partitions under
+`{df_dir}/partitions/{name}/`, so an incremental preprocessing run only
+rewrites the months that received new rows.
+"""
+
+import hashlib
+import json
+import os
+import shutil
+
+import numpy as np
+import pandas as pd
+
+from schema import SCHEMA, apply_schema
+
+COLUMN_STORE_DIR = "columns"
+PARTITION_DIR = "partitions"
+
+
+# ---------------------------------------------------------------------------
+# Memory-mapped column store
+# ---------------------------------------------------------------------------
+
+
+def column_store_path(df_dir: str, name: str) -> str:
+    return f"{df_dir}/{COLUMN_STORE_DIR}/{name}"
+
+
+def write_column_store(df, df_dir: str, name: str) -> None:
+    """Write *df* as one .npy file per column plus a `_schema.json`.
+
+    String columns are stored as categorical codes (`{column}.npy`) and their
+    categories (`{column}.categories.npy`), nullable integer and boolean
+    columns as their values and a missing-value mask (`{column}.mask.npy`).
+    The new directory replaces the old one by rename, so workers still
+    mapping the previous files keep reading a consistent table.
+    """
+    target = column_store_path(df_dir, name)
+    staging, retired = f"{target}.tmp", f"{target}.old"
+    shutil.rmtree(staging, ignore_errors=True)
+    os.makedirs(staging)
+
+    schema = []
+    for column in df.columns:
+        values = df[column]
+        if values.dtype == object:
+            values = values.astype("category")
+        entry = {"name": column, "categorical": isinstance(values.dtype, pd.CategoricalDtype)}
+        if entry["categorical"]:
+            categories = values.cat.categories
+            if categories.inferred_type == "string":
+                categories = categories.astype(str)  # fixed-width, no pickling
+            np.save(f"{staging}/{column}.categories.npy", categories.to_numpy())
+            array = values.cat.codes.to_numpy()
+        elif isinstance(values.dtype, pd.api.extensions.ExtensionDtype) and hasattr(values.dtype, "numpy_dtype"):
+            # nullable Int/boolean: the values plus a missing-value mask
+            entry["nullable"] = values.dtype.name
+            np.save(f"{staging}/{column}.mask.npy", values.isna().to_numpy())
+            array = values.to_numpy(dtype=values.dtype.numpy_dtype, na_value=0)
+        else:
+            array = values.to_numpy()
+        np.save(f"{staging}/{column}.npy", array)
+        schema.append(entry)
+    with open(f"{staging}/_schema.json", "w") as f:
+        json.dump(schema, f)
+
+    shutil.rmtree(retired, ignore_errors=True)
+    if os.path.exists(target):
+        os.rename(target, retired)
+    os.rename(staging, target)
+    shutil.rmtree(retired, ignore_errors=True)
+
+
+def read_column_store(df_dir: str, name: str) -> pd.DataFrame:
+    """Memory-map a table written by write_column_store() without copying it."""
+    directory = column_store_path(df_dir, name)
+    with open(f"{directory}/_schema.json") as f:
+        schema = json.load(f)
+
+    columns = {}
+    for entry in schema:
+        array = np.load(f"{directory}/{entry['name']}.npy", mmap_mode="r")
+        if entry["categorical"]:
+            categories = np.load(f"{directory}/{entry['name']}.categories.npy", allow_pickle=True)
+            array = pd.Categorical.from_codes(array, categories=categories)
+        elif entry.get("nullable"):
+            mask = np.load(f"{directory}/{entry['name']}.mask.npy", mmap_mode="r")
+            array = pd.api.types.pandas_dtype(entry["nullable"]).construct_array_type()(array, mask)
+        columns[entry["name"]] = array
+    # copy=False also skips block consolidation, which would copy the mapped arrays
+    return pd.DataFrame(columns, copy=False)
+
+
+# ---------------------------------------------------------------------------
+# Tables
+# ---------------------------------------------------------------------------
+
+
+def table_path(df_dir: str, name: str) -> str:
+    """Return the Parquet path of table *name*, or its CSV path if only that exists."""
+    parquet_path = f"{df_dir}/{name}.parquet"
+    if not os.path.exists(parquet_path) and os.path.exists(f"{df_dir}/{name}.csv"):
+        return f"{df_dir}/{name}.csv"
+    return parquet_path
+
+
+def table_exists(df_dir: str, name: str) -> bool:
+    """Return True if table *name* has been written in any format."""
+    return os.path.exists(table_path(df_dir, name)) or os.path.exists(
+        column_store_path(df_dir, name)
+    )
+
+
+def write_table(df, df_dir: str, name: str) -> None:
+    """Write *df* with its schema dtypes to `{df_dir}/{name}.parquet` and to the column store.
+
+    The column store is written first: gunicorn reloads on the Parquet
+    change, and the reloaded workers then map the new columns.
+    """
+    df = apply_schema(df.copy(), name)
+    write_column_store(df, df_dir, name)
+    df.to_parquet(f"{df_dir}/{name}.parquet", index=False, compression="zstd")
+
+
+# ---------------------------------------------------------------------------
+# Monthly partitions
+# ---------------------------------------------------------------------------
+
+
+def partition_dir(df_dir: str, name: str) -> str:
+    return f"{df_dir}/{PARTITION_DIR}/{name}"
+
+
+def append_partitions(df, df_dir: str, name: str) -> None:
+    """Merge the rows of *df* into the monthly partitions of *name*.
+
+    Each month of `df["datetime"]` is one `{YYYY-MM}.parquet` file, sorted by
+    datetime; rows of *df* go after existing rows with the same datetime.
+    Partitions are replaced by rename, never rewritten in place.
+    """
+    directory = partition_dir(df_dir, name)
+    os.makedirs(directory, exist_ok=True)
+    for month, rows in df.groupby(df["datetime"].dt.strftime("%Y-%m"), sort=True):
+        path = f"{directory}/{month}.parquet"
+        if os.path.exists(path):
+            rows = pd.concat([pd.read_parquet(path), rows], ignore_index=True)
+        _write_partition(rows.sort_values("datetime", kind="stable", ignore_index=True), path)
+
+
+def truncate_partitions(df_dir: str, name: str, after) -> None:
+    """Drop the rows dated after *after*, e.g. left behind by an interrupted run."""
+    for path in _partition_paths(df_dir, name, since=after):
+        rows = pd.read_parquet(path)
+        kept = rows["datetime"] <= after
+        if not kept.all():
+            _write_partition(rows[kept], path)
+
+
+def clear_partitions(df_dir: str, name: str) -> None:
+    shutil.rmtree(partition_dir(df_dir, name), ignore_errors=True)
+
+
+def read_partitions(df_dir: str, name: str, columns=None, since=None) -> pd.DataFrame:
+    """Concatenate the partitions of *name*; the result is sorted by datetime.
+
+    With *since*, only the months from that of *since* on are read (rows
+    before *since* in its month are kept). A table without partitions, e.g.
+    from an export with no rows, reads as an empty frame with its schema
+    columns.
+    """
+    frames = [pd.read_parquet(path, columns=columns) for path in _partition_paths(df_dir, name, since)]
+    if not frames:
+        return pd.DataFrame(columns=columns or list(SCHEMA.get(f"processed_{name}", {})))
+    return pd.concat(frames, ignore_index=True)
+
+
+def _partition_paths(df_dir: str, name: str, since=None) -> list:
+    directory = partition_dir(df_dir, name)
+    if not os.path.isdir(directory):
+        return []
+    paths = sorted(e.path for e in os.scandir(directory) if e.name.endswith(".parquet"))
+    if since is not None:
+        first_month = pd.Timestamp(since).strftime("%Y-%m")
+        paths = [p for p in paths if os.path.basename(p)[: len("YYYY-MM")] >= first_month]
+    return paths
+
+
+def _write_partition(rows, path: str) -> None:
+    rows.to_parquet(f"{path}.tmp", index=False, compression="zstd")
+    os.replace(f"{path}.tmp", path)
+
+
+def dataset_version(df_dir: str) -> str:
+    """Short stamp that changes whenever a file of the processed data is rewritten."""
+    directories = [df_dir]
+    store = f"{df_dir}/{COLUMN_STORE_DIR}"
+    if os.path.isdir(store):
+        directories += sorted(e.path for e in os.scandir(store) if e.is_dir())
+
+    stamps = []
+    for directory in directories:
+        for entry in sorted(os.scandir(directory), key=lambda e: e.name):
+            if entry.is_file():
+                stat = entry.stat()
+                stamps.append(f"{entry.path}:{stat.st_size}:{stat.st_mtime_ns}")
+    return hashlib.sha1("\n".join(stamps).encode()).hexdigest()[:16]
+
+
+def read_table(df_dir: str, name: str, **csv_kwargs) -> pd.DataFrame:
+    """Load table *name* from the column store, Parquet, or CSV (in that order).
+
+    The result has the dtypes declared in `schema.SCHEMA`. *csv_kwargs* are
+    passed to `pd.read_csv` for the CSV fallback only.
+    """
+    if os.path.exists(column_store_path(df_dir, name)):
+        df = read_column_store(df_dir, name)
+    else:
+        path = table_path(df_dir, name)
+        if path.endswith(".parquet"):
+            df = pd.read_parquet(path)
+        else:
+            df = pd.read_csv(path, **csv_kwargs)
+    return apply_schema(df, name)
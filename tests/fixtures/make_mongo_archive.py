@@ -0,0 +1,82 @@
+"""
+make_mongo_archive.py — Write the `mongodump --archive --gzip` fixture used by test_mongo_archive.py.
+
+    PYTHONPATH=. python tests/fixtures/make_mongo_archive.py
+
+The archive interleaves the blocks of entries, sessions, users and an
+unrelated admin collection, and holds documents with missing fields and
+fields stored with more than one BSON type.
+"""
+
+import gzip
+import os
+import struct
+
+import bson
+from bson import Int64, ObjectId
+
+from mongo_archive import DATABASE, MAGIC_NUMBER, TERMINATOR
+
+PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "mongo_backup_2024_01_01.tar.gz")
+
+ENTRIES = [
+    {"timestamp": Int64(1704067200000), "sessionId": "s1", "action": "startSession",
+     "countryCode": "TW", "ipHash": "h1"},
+    {"timestamp": Int64(1704067260000), "sessionId": "s1", "action": "fileOpen", "countryCode": "TW",
+     "ipHash": "h1", "details": {"width": 512, "height": 512, "depth": 100, "stokes": 1}},
+    # no countryCode, no stokes, a double width
+    {"timestamp": Int64(1704067320000), "sessionId": "s1", "action": "fileOpen", "ipHash": "h1",
+     "details": {"width": 1024.5, "height": 2048, "depth": 1}},
+    {"timestamp": Int64(1704067380000), "sessionId": "s1", "action": "spectralProfileGeneration",
+     "countryCode": "TW", "ipHash": "h1",
+     "details": {"profileLength": 100, "regionId": 1, "width": 512, "height": 512, "depth": 100}},
+]
+MORE_ENTRIES = [
+    # a double timestamp and an integer ipHash
+    {"timestamp": 1704153600000.0, "sessionId": "s2", "action": "startSession", "countryCode": "DE",
+     "ipHash": 12345},
+    {"timestamp": Int64(1704153660000), "sessionId": "s2", "action": "endSession", "countryCode": "DE",
+     "ipHash": 12345},
+]
+SESSIONS = [
+    {"id": "s1", "userId": "u1", "version": "4.0.0", "startTime": Int64(1704067200000),
+     "endTime": Int64(1704067500000), "duration": 300000, "backendPlatform": "Linux",
+     "backendPlatformInfo": {"distro": "Ubuntu 22.04.3 LTS", "variant": "", "version": "22.04"}},
+    # still open: no endTime or duration; a double version; no distro
+    {"id": "s2", "userId": "u2", "version": 4.0, "startTime": Int64(1704153600000),
+     "backendPlatform": "macOS", "backendPlatformInfo": {"version": "14.2"}},
+]
+USERS = [
+    {"_id": ObjectId("65920080a1b2c3d4e5f60718"), "uuid": "u1", "countryCode": "TW", "optOut": False,
+     "regionCode": "TPE"},
+    {"_id": ObjectId("65920080a1b2c3d4e5f60719"), "uuid": "u2", "countryCode": "DE"},
+]
+ADMIN = [{"_id": "featureCompatibilityVersion", "version": "6.0"}]
+
+
+def _block(db: str, collection: str, documents: list, eof: bool = False) -> bytes:
+    header = bson.encode({"db": db, "collection": collection, "EOF": eof, "CRC": Int64(0)})
+    return header + b"".join(bson.encode(document) for document in documents) + TERMINATOR
+
+
+def main() -> None:
+    namespaces = [(DATABASE, "entries"), (DATABASE, "sessions"), (DATABASE, "users"), ("admin", "system.version")]
+    prelude = bson.encode({"concurrent_collections": 4, "version": "0.1", "server_version": "6.0.0",
+                           "tool_version": "100.9.0"})
+    for db, collection in namespaces:
+        prelude += bson.encode({"db": db, "collection": collection, "metadata": "{}", "size": 0,
+                                "type": "collection"})
+    blocks = [
+        _block(DATABASE, "entries", ENTRIES),
+        _block("admin", "system.version", ADMIN),
+        _block(DATABASE, "sessions", SESSIONS),
+        _block(DATABASE, "entries", MORE_ENTRIES),
+        _block(DATABASE, "users", USERS),
+    ]
+    blocks += [_block(db, collection, [], eof=True) for db, collection in namespaces]
+    with gzip.GzipFile(PATH, "wb", mtime=0) as stream:
+        stream.write(struct.pack("<I", MAGIC_NUMBER) + prelude + TERMINATOR + b"".join(blocks))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,56 @@
+"""
+test_hll.py — Accuracy of the HyperLogLog estimates against exact counts.
+"""
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from distinct import build_distinct_index, distinct_counts
+from hll import STANDARD_ERROR, build_daily_sketches, estimate, merged_estimates
+
+
+@pytest.fixture(scope="module")
+def entries():
+    """Six months of entries; daily cardinalities range from tens to thousands."""
+    rng = np.random.default_rng(12345)
+    days = pd.date_range("2024-01-01", "2024-06-30", freq="D")
+    rows = rng.integers(20, 4000, size=len(days))
+    day = np.repeat(days, rows)
+    # each day draws from a pool that shifts over time, so weeks and months overlap partially
+    offset = np.repeat(np.arange(len(days)) * 300, rows)
+    codes = offset + rng.integers(0, 5000, size=rows.sum())
+    return pd.DataFrame({
+        "datetime": day + pd.to_timedelta(rng.integers(0, 86_400, size=rows.sum()), unit="s"),
+        "countryCode": "DE",
+        "ipHash": codes.astype(np.int32),
+    })
+
+
+@pytest.mark.parametrize("cardinality", [10, 1_000, 10_000, 200_000])
+def test_single_sketch_error(cardinality):
+    df = pd.DataFrame({
+        "datetime": pd.Timestamp("2024-01-01"),
+        "ipHash": np.arange(cardinality, dtype=np.int64),
+    })
+    _, registers = build_daily_sketches(df, "ipHash")
+    error = abs(estimate(registers)[0] - cardinality) / cardinality
+    assert error < 3 * STANDARD_ERROR
+
+
+@pytest.mark.parametrize("period", ["d", "W", "MS"])
+def test_merged_estimates_error(entries, period):
+    exact = distinct_counts(build_distinct_index(entries, "ipHash"), period)
+    approx = merged_estimates(build_daily_sketches(entries, "ipHash"), period)
+
+    assert approx.index.equals(exact.index)
+    error = ((approx - exact) / exact).abs()
+    assert error.mean() < STANDARD_ERROR
+    assert error.max() < 4 * STANDARD_ERROR
+
+
+def test_merged_estimates_window(entries):
+    sketches = build_daily_sketches(entries, "ipHash")
+    window = (pd.Timestamp("2024-02-01"), pd.Timestamp("2024-03-01"))
+    whole = merged_estimates(sketches, "MS")
+    assert merged_estimates(sketches, "MS", window).equals(whole.loc[["2024-02-01"]])
@@ -0,0 +1,79 @@
+"""
+test_mongo_archive.py — Outputs of mongo_archive.py on a fixture archive.
+
+The fixture is written by fixtures/make_mongo_archive.py.
+"""
+
+import os
+
+import numpy as np
+import pandas as pd
+import pyarrow.parquet as pq
+import pytest
+
+from mongo_archive import OUTPUTS, iter_archive, write_outputs
+
+ARCHIVE = os.path.join(os.path.dirname(__file__), "fixtures", "mongo_backup_2024_01_01.tar.gz")
+
+
+@pytest.fixture(scope="module")
+def outputs(tmp_path_factory):
+    directory = tmp_path_factory.mktemp("archive")
+    write_outputs(ARCHIVE, str(directory), str(directory), batch_size=2)
+    return directory
+
+
+def read(directory, name):
+    return pd.read_parquet(directory / f"{name}.parquet")
+
+
+def test_only_telemetry_documents(outputs):
+    collections = [collection for collection, _ in iter_archive(ARCHIVE)]
+    assert collections == ["entries"] * 4 + ["sessions"] * 2 + ["entries"] * 2 + ["users"] * 2
+
+
+def test_entries(outputs):
+    entries = read(outputs, "entries")
+    assert list(entries.columns) == OUTPUTS["entries"][2]
+    assert entries["timestamp"].tolist() == [
+        1704067200000, 1704067260000, 1704067320000, 1704067380000, 1704153600000, 1704153660000,
+    ]
+    assert entries["ipHash"].tolist() == ["h1"] * 4 + ["12345"] * 2
+    assert entries["countryCode"].tolist() == ["TW", "TW", None, "TW", "DE", "DE"]
+    # written in row groups of batch_size rows, not all at once
+    assert pq.ParquetFile(outputs / "entries.parquet").num_row_groups == 3
+
+
+def test_files_and_spectral(outputs):
+    files = read(outputs, "file_details")
+    assert list(files.columns) == OUTPUTS["file_details"][2]
+    assert files["details.width"].tolist() == [512.0, 1024.5]
+    assert files["details.stokes"].tolist()[0] == 1.0
+    assert np.isnan(files["details.stokes"].tolist()[1])
+
+    spectral = read(outputs, "spectralProfileGeneration")
+    assert spectral[["details.profileLength", "details.regionId"]].values.tolist() == [[100.0, 1.0]]
+
+
+def test_sessions(outputs):
+    sessions = read(outputs, "sessions")
+    assert list(sessions.columns) == OUTPUTS["sessions"][2]
+    assert sessions["version"].tolist() == ["4.0.0", "4.0"]
+    assert sessions["endTime"].isna().tolist() == [False, True]
+    assert sessions["backendPlatformInfo.distro"].tolist() == ["Ubuntu 22.04.3 LTS", None]
+    assert sessions["backendPlatformInfo.version"].tolist() == ["22.04", "14.2"]
+
+
+def test_users_snapshot(outputs):
+    users = read(outputs, "users_2024_01_01")
+    assert users["_id"].tolist() == ["65920080a1b2c3d4e5f60718", "65920080a1b2c3d4e5f60719"]
+    assert users["optOut"].tolist() == [False, None]
+    assert users["regionCode"].tolist() == ["TPE", None]
+
+
+def test_output_without_documents(tmp_path, monkeypatch):
+    monkeypatch.setitem(OUTPUTS, "catalogLoading", ("entries", "catalogLoading", ["timestamp", "countryCode"]))
+    write_outputs(ARCHIVE, str(tmp_path), str(tmp_path), batch_size=2)
+    empty = pq.ParquetFile(tmp_path / "catalogLoading.parquet")
+    assert empty.metadata.num_rows == 0
+    assert [str(t) for t in empty.schema_arrow.types] == ["int64", "string"]
@@ -0,0 +1,214 @@
+"""
+test_preprocess.py — Parity of the vectorized preprocessing steps with the row loops they replaced.
+"""
+
+import os
+from datetime import datetime, timedelta
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from preprocess_df import extract_missing_data_dates, load_missing_data_thresholds, process_sessions
+
+THRESHOLDS = os.path.join(os.path.dirname(__file__), '..', 'missing_data_thresholds.csv')
+
+
+def reference_os_columns(sessions_df):
+    """OS / OS_version as the former row-by-row loop of process_sessions() computed them.
+
+    The loop collected the names in a NumPy array of fixed-width strings,
+    which cut the longer replacements ("Debian G"); an object array keeps
+    the names whole, as the vectorized code does.
+    """
+    OS_version_array = []
+    OS_array = []
+    for i in range(sessions_df.__len__()):
+        OS_version = sessions_df['backendPlatformInfo.version'].iloc[i]
+
+        if sessions_df['backendPlatform'].iloc[i] == 'macOS':
+            OS_version_array.append(OS_version.split('.')[0])
+            OS_array.append(sessions_df['backendPlatform'].iloc[i])
+        else:
+            OS_version_array.append(OS_version)
+            OS = str(sessions_df['backendPlatformInfo.distro'].iloc[i])
+            OS_array.append(OS.split(' ')[0])
+
+    OS_array = np.array(OS_array, dtype=object)
+    r = np.where(OS_array == 'Debian')[0]
+    OS_array[r] = 'Debian GNU'
+    r = np.where((OS_array == 'Red') | (OS_array == 'RHEL'))[0]
+    OS_array[r] = 'Red Hat'
+    r = np.where(OS_array == 'Trisquel')[0]
+    OS_array[r] = 'Trisquel GNU'
+    r = np.where(OS_array == 'Linux')[0]
+    OS_array[r] = 'Linux Mint'
+
+    OS = pd.Series(OS_array)
+    OS[OS == 'nan'] = np.nan
+    return pd.DataFrame({'OS_version': OS_version_array, 'OS': OS})
+
+
+def sessions(platforms):
+    """Sessions export rows from (backendPlatform, distro, version) triples."""
+    rows = pd.DataFrame(platforms, columns=['backendPlatform', 'backendPlatformInfo.distro', 'backendPlatformInfo.version'])
+    rows.insert(0, 'id', [f's{i}' for i in range(len(rows))])
+    rows.insert(1, 'startTime', 1704067200000 + 1000 * np.arange(len(rows)))
+    rows['backendPlatformInfo.variant'] = np.nan
+    return rows
+
+
+def os_columns(sessions_df):
+    entries_df = pd.DataFrame({'sessionId': sessions_df['id'], 'countryCode': 'TW'})
+    processed = process_sessions(sessions_df.copy(), entries_df)
+    return processed[['OS_version', 'OS']].astype(object)
+
+
+PLATFORMS = [
+    ('Linux', 'Ubuntu 22.04.3 LTS', '22.04'),
+    ('Linux', 'Debian GNU/Linux 12 (bookworm)', '12'),
+    ('Linux', 'Red Hat Enterprise Linux 9.2 (Plow)', '9.2'),
+    ('Linux', 'RHEL 8', '8.8'),
+    ('Linux', 'Trisquel GNU/Linux 11', '11'),
+    ('Linux', 'Linux Mint 21.2', '21.2'),
+    ('Linux', 'AlmaLinux 9.3', '9.3'),
+    ('Linux', ' Ubuntu 20.04', '20.04'),  # leading space: empty first word
+    ('Linux', '  CentOS 7', ' 7'),
+    ('Linux', np.nan, '22.04'),  # no distro
+    ('Linux', 'Fedora 39', np.nan),  # no version
+    ('Linux', np.nan, np.nan),
+    ('macOS', np.nan, '14.2.1'),
+    ('macOS', 'macOS', '13'),
+    ('macOS', np.nan, '10.15.7'),
+    ('Windows', np.nan, '10'),  # unknown platforms take the distro branch
+    ('Windows', 'Windows 11', '22H2'),
+    (np.nan, np.nan, '1.0'),
+    (np.nan, 'Debian 11', '11'),
+]
+
+
+def test_os_columns_match_row_loop():
+    rows = sessions(PLATFORMS)
+    pd.testing.assert_frame_equal(os_columns(rows), reference_os_columns(rows).astype(object))
+
+
+def test_os_columns_match_row_loop_random():
+    rng = np.random.default_rng(7)
+    rows = sessions([PLATFORMS[i] for i in rng.integers(0, len(PLATFORMS), 5000)])
+    pd.testing.assert_frame_equal(os_columns(rows), reference_os_columns(rows).astype(object))
+
+
+def test_os_columns_without_any_version():
+    # a chunk in which every version is missing reads as a float column
+    rows = sessions([('Linux', 'Ubuntu 22.04', np.nan), ('Windows', np.nan, np.nan)])
+    pd.testing.assert_frame_equal(os_columns(rows), reference_os_columns(rows).astype(object))
+
+
+@pytest.mark.parametrize('version', [np.nan, None])
+def test_macos_without_version(version):
+    # the row loop raised on these; the vectorized code leaves the version missing
+    result = os_columns(sessions([('macOS', np.nan, version)]))
+    assert result['OS'].tolist() == ['macOS']
+    assert pd.isna(result['OS_version'].iloc[0])
+
+
+def reference_missing_data_dates(entries_df, first_date, today):
+    """The former extract_missing_data_dates(), with its hard-coded thresholds."""
+    selected_index = (entries_df['datetime'] > first_date.strftime('%Y-%m-%d')) & (entries_df['datetime'] <= today.strftime('%Y-%m-%d'))
+    resample_dates = entries_df[selected_index].resample('d', on='datetime')
+    date_counts = resample_dates.apply(lambda x: x.ipHash.unique().size)
+
+    xmas_newyear_holidays = ['12-24', '12-25', '12-26', '12-27', '12-28', '12-29', '12-30', '12-31', '01-01', '01-02', '01-03', '01-04', '01-05']
+    unusual_threshold = {'2021': {'workday': 0, 'holiday': 0},
+                         '2022': {'workday': 0, 'holiday': 0},
+                         '2023': {'workday': 60, 'holiday': 20},
+                         '2024': {'workday': 80, 'holiday': 30},
+                         '2025': {'workday': 100, 'holiday': 40}}
+    for year in range(2026, today.year + 1):
+        unusual_threshold[f'{year}'] = unusual_threshold[f'{year-1}']
+
+    missing_data = []
+    for i in range((today - first_date).days):
+        current_date = first_date + timedelta(days=i)
+        formatted_date = f"{current_date.year}-{current_date.month:02d}-{current_date.day:02d}"
+
+        if not formatted_date in date_counts.keys():
+            continue
+
+        if (f"{current_date.month:02d}-{current_date.day:02d}" in xmas_newyear_holidays) | (current_date.weekday() in [5, 6]):
+            if date_counts[formatted_date] < unusual_threshold[f'{current_date.year}']['holiday']:
+                missing_data.append(formatted_date)
+        else:
+            if date_counts[formatted_date] < unusual_threshold[f'{current_date.year}']['workday']:
+                missing_data.append(formatted_date)
+
+    return pd.DataFrame(pd.to_datetime(missing_data, format='%Y-%m-%d'), columns=['datetime'])
+
+
+@pytest.fixture(scope='module')
+def entries():
+    """Entries from mid-December 2022 to January 2026 with 0-150 distinct IPs a day.
+
+    2023-06-14 (a Wednesday) has no entries at all. Each day also has
+    entries at exactly midnight and at its last millisecond, and some have
+    no ipHash.
+    """
+    rng = np.random.default_rng(2024)
+    days = pd.date_range('2022-12-15', '2026-01-10', freq='D')
+    days = days[days != '2023-06-14']
+    ips_per_day = rng.integers(0, 150, len(days))
+    day = np.repeat(days, ips_per_day * 2)
+    offset = pd.to_timedelta(rng.integers(0, 86_400_000, len(day)), unit='ms')
+    ip = np.concatenate([np.tile(np.arange(n), 2) for n in ips_per_day]).astype(str)
+    rows = pd.DataFrame({'datetime': day + offset, 'ipHash': ip}).astype({'ipHash': object})
+    rows.loc[rng.random(len(rows)) < 0.01, 'ipHash'] = np.nan
+
+    edges = pd.DataFrame({
+        'datetime': np.concatenate([days, days + pd.Timedelta(days=1) - pd.Timedelta(milliseconds=1)]),
+        'ipHash': 'edge',
+    })
+    return pd.concat([rows, edges]).sort_values('datetime', kind='stable', ignore_index=True)
+
+
+@pytest.mark.parametrize('first_date, today', [
+    (datetime(2022, 12, 1), datetime(2026, 1, 11)),  # the whole data, past the last listed year
+    (datetime(2022, 12, 20), datetime(2023, 1, 10)),  # holidays across a year change
+    (datetime(2023, 6, 1), datetime(2023, 7, 1)),  # around the day without entries
+    (datetime(2023, 6, 14), datetime(2023, 6, 15)),  # only that day: no entries, nothing reported
+    (datetime(2024, 2, 28), datetime(2024, 3, 2)),  # leap day
+    (datetime(2025, 12, 30), datetime(2026, 1, 2)),
+])
+def test_missing_data_dates_match_loop(entries, first_date, today):
+    thresholds = load_missing_data_thresholds(THRESHOLDS)
+    result = extract_missing_data_dates(entries, first_date, today, thresholds)
+    pd.testing.assert_frame_equal(result, reference_missing_data_dates(entries, first_date, today))
+
+
+def test_missing_data_dates_without_entries(entries):
+    thresholds = load_missing_data_thresholds(THRESHOLDS)
+    result = extract_missing_data_dates(entries, datetime(2030, 1, 1), datetime(2030, 2, 1), thresholds)
+    assert result.empty and list(result.columns) == ['datetime']
+
+
+@pytest.mark.parametrize('first_day', ['2024-03-05', '2024-03-06', '2024-03-09'])
+def test_missing_data_dates_incremental_matches_full(first_day):
+    # 79 IPs at noon and one more at midnight: 80 is exactly the 2024 workday threshold
+    days = pd.date_range('2024-03-01', '2024-03-11', freq='D')
+    noon = pd.DataFrame({
+        'datetime': np.repeat(days + pd.Timedelta(hours=12), 79),
+        'ipHash': np.tile([f'ip{i}' for i in range(79)], len(days)),
+    })
+    midnight = pd.DataFrame({'datetime': days, 'ipHash': 'midnight'})
+    entries = pd.concat([midnight, noon]).sort_values('datetime', kind='stable', ignore_index=True)
+    thresholds = load_missing_data_thresholds(THRESHOLDS)
+    today = datetime(2024, 3, 12)
+
+    full = extract_missing_data_dates(entries, datetime(2021, 12, 1), today, thresholds)
+    first_day = pd.Timestamp(first_day)
+    incremental = pd.concat(
+        [full[full['datetime'] < first_day],
+         extract_missing_data_dates(entries, first_day, today, thresholds, inclusive=True)],
+        ignore_index=True,
+    )
+    assert full.empty
+    pd.testing.assert_frame_equal(incremental, full)
@@ -0,0 +1,42 @@
+"""
+test_storage.py — Round trips through the processed data layer.
+"""
+
+import numpy as np
+import pandas as pd
+
+from schema import SCHEMA
+from storage import read_column_store, read_partitions, read_table, truncate_partitions, write_table
+
+
+def test_missing_values_survive_the_schema(tmp_path):
+    sessions = pd.DataFrame({
+        "datetime": pd.to_datetime(["2024-01-01", "2024-01-02"]),
+        "endTime": [1704067200000, np.nan],
+        "duration": [1000, np.nan],
+    })
+    users = pd.DataFrame({
+        "_id": ["00000000000000000000000a", "00000000000000000000000b"],
+        "optOut": [False, None],
+    })
+    write_table(sessions, str(tmp_path), "processed_sessions")
+    write_table(users, str(tmp_path), "processed_users")
+
+    for read in (read_table, read_column_store):
+        result = read(str(tmp_path), "processed_sessions")
+        assert result["endTime"].tolist() == [1704067200000, pd.NA]
+        assert result["duration"].tolist() == [1000, pd.NA]
+        result = read(str(tmp_path), "processed_users")
+        assert result["optOut"].tolist() == [False, pd.NA]
+        assert result["_id"].tolist() == [0, 1]
+
+    parquet = pd.read_parquet(tmp_path / "processed_sessions.parquet")
+    assert parquet["endTime"].dtype == "Int64"
+
+
+def test_table_without_partitions(tmp_path):
+    truncate_partitions(str(tmp_path), "spectral", pd.Timestamp("2024-01-01"))
+    result = read_partitions(str(tmp_path), "spectral")
+    assert result.empty
+    assert list(result.columns) == list(SCHEMA["processed_spectral"])
+    assert read_partitions(str(tmp_path), "entries", columns=["datetime"]).columns.tolist() == ["datetime"]